@@ -0,0 +1,64 @@
+"""
+Compares the SQL statistics of `SmartHouseRepository` with the NumPy versions in
+`smarthouse.analytics` on a synthetic house with a temperature and a humidity sensor
+per room, and checks that both give the same answers.
+
+    python -m benchmarks.analytics --rooms 50 --days 365 --interval 60
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import create_house_database, add_measurements, build_indexes
+from smarthouse import analytics
+from smarthouse.persistence import SmartHouseRepository
+
+
+def timed(fn, rooms) -> float:
+    start = time.perf_counter()
+    for room in rooms:
+        fn(room)
+    return (time.perf_counter() - start) / len(rooms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--interval", type=int, default=60, help="seconds between readings")
+    parser.add_argument("--from-date", default="2024-01-08")
+    parser.add_argument("--until-date", default="2024-03-31")
+    parser.add_argument("--date", default="2024-01-15")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "house.sql"
+        create_house_database(db_file, 1, args.rooms, 2)
+        rows = add_measurements(db_file, days=args.days, interval=args.interval)
+        print(f"generated {rows} measurements")
+
+        build_indexes(db_file)
+        repo = SmartHouseRepository(db_file)
+        rooms = repo.load_smarthouse_deep().get_rooms()
+        cases = [
+            ("average temperatures",
+             lambda r: repo.calc_avg_temperatures_in_room(r, args.from_date, args.until_date),
+             lambda r: analytics.avg_temperatures_in_room(repo, r, args.from_date, args.until_date)),
+            ("humidity hours",
+             lambda r: repo.calc_hours_with_humidity_above(r, args.date),
+             lambda r: analytics.hours_with_humidity_above(repo, r, args.date)),
+        ]
+        for name, sql, vectorized in cases:
+            for room in rooms[:5]:
+                expected, actual = sql(room), vectorized(room)
+                if isinstance(expected, dict):
+                    assert expected.keys() == actual.keys() and all(abs(expected[k] - actual[k]) < 1e-9 for k in expected), name
+                else:
+                    assert sorted(expected) == sorted(actual), name
+            print(f"{name:22s} SQL={timed(sql, rooms) * 1000:8.3f} ms/room  NumPy={timed(vectorized, rooms) * 1000:8.3f} ms/room")
+        del repo
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares `calc_avg_temperatures_in_room` with the previous `DATE(ts)`-filtered query
+on a synthetic house with one temperature sensor per room, and a loop over all rooms
+with the batch variant `calc_avg_temperatures_in_rooms`.
+
+    python -m benchmarks.avg_temperatures --rooms 1000 --days 365 --interval 60
+
+The defaults correspond to a year of per-minute readings for 1,000 rooms
+(about 525M rows); use fewer rooms/days or a longer interval for a quick run.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import create_house_database, add_measurements, build_indexes
+from smarthouse.persistence import SmartHouseRepository
+
+# Spørringen slik den var før den ble skrevet om, til sammenligning
+LEGACY_QUERY = """
+    SELECT DATE(m.ts) as date, AVG(m.value) as avg_temp
+    FROM measurements m
+    INNER JOIN devices d ON m.device = d.id
+    INNER JOIN rooms r ON d.room = r.id
+    WHERE r.name = ? AND m.unit = '°C'
+    AND DATE(m.ts) >= ? AND DATE(m.ts) <= ?
+    GROUP BY DATE(m.ts)
+"""
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--interval", type=int, default=60, help="seconds between readings")
+    parser.add_argument("--from-date", default="2024-01-08")
+    parser.add_argument("--until-date", default="2024-01-14")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "house.sql"
+        create_house_database(db_file, 1, args.rooms, 1)
+        start = time.perf_counter()
+        rows = add_measurements(db_file, days=args.days, interval=args.interval)
+        print(f"generated {rows} measurements in {time.perf_counter() - start:.1f} s")
+
+        build_indexes(db_file)
+        repo = SmartHouseRepository(db_file)
+        house = repo.load_smarthouse_deep()
+        room = house.get_rooms()[len(house.get_rooms()) // 2]
+
+        legacy = timed(lambda: repo.conn.execute(LEGACY_QUERY, (room.room_name, args.from_date, args.until_date)).fetchall(), args.repeat)
+        current = timed(lambda: repo.calc_avg_temperatures_in_room(room, args.from_date, args.until_date), args.repeat)
+        print(f"DATE(ts) filter on raw rows:   {legacy * 1000:.2f} ms")
+        print(f"calc_avg_temperatures_in_room: {current * 1000:.2f} ms")
+
+        # Hele huset: én spørring per rom mot én gruppert spørring
+        rooms = house.get_rooms()
+        per_room = timed(lambda: [repo.calc_avg_temperatures_in_room(r, args.from_date, args.until_date) for r in rooms], args.repeat)
+        batch = timed(lambda: repo.calc_avg_temperatures_in_rooms(house, args.from_date, args.until_date), args.repeat)
+        print(f"{len(rooms)} rooms, one query per room: {per_room * 1000:.2f} ms")
+        print(f"{len(rooms)} rooms, calc_avg_temperatures_in_rooms: {batch * 1000:.2f} ms")
+        del repo
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+pytest-benchmark suite for the hot paths of the domain model and the repository, run
+against synthetic houses of several sizes (see `benchmarks/synthetic.py`). The file name
+does not match `test_*.py`, so a plain `pytest` run leaves it out and the correctness tests
+stay fast; run it explicitly from the repository root:
+
+    python -m pip install pytest-benchmark
+    python -m pytest benchmarks/hot_paths.py --benchmark-autosave
+
+`--benchmark-autosave` stores the results under `.benchmarks/`. A later run compared
+against the last stored one fails if the fastest round of any benchmark got more than 25%
+slower (the minimum is much steadier than the mean on a busy machine):
+
+    python -m pytest benchmarks/hot_paths.py --benchmark-compare --benchmark-compare-fail=min:25%
+
+The scales are chosen with SMARTHOUSE_BENCHMARK_SCALES (default "small,medium"; "large"
+builds a house with ~14M readings and takes a few minutes to generate). Compare only runs
+on the same machine and scales.
+"""
+import itertools
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.synthetic import add_measurements, build_indexes, create_house_database
+from smarthouse.persistence import SmartHouseRepository
+
+
+class Scale:
+
+    def __init__(self, name: str, floors: int, rooms: int, devices: int, days: int, interval: float):
+        self.name = name
+        self.floors = floors
+        self.rooms = rooms
+        self.devices = devices
+        self.days = days
+        self.interval = interval
+
+
+# Målingene starter 2024-01-01, så alle tidsrommene under ligger innenfor
+SCALES = {
+    "small": Scale("small", 1, 10, 4, 30, 300),
+    "medium": Scale("medium", 4, 25, 4, 30, 300),
+    "large": Scale("large", 10, 100, 10, 30, 900),
+}
+SELECTED = [SCALES[name.strip()] for name in os.environ.get("SMARTHOUSE_BENCHMARK_SCALES", "small,medium").split(",")]
+
+FROM_DATE = "2024-01-08"
+UNTIL_DATE = "2024-01-21"
+DATE = "2024-01-15"
+
+
+@pytest.fixture(scope="session", params=SELECTED, ids=lambda scale: scale.name)
+def database(request, tmp_path_factory):
+    scale = request.param
+    db_file = tmp_path_factory.mktemp(scale.name) / "house.sql"
+    # Samme frø gir samme hus, slik at lagrede resultater kan sammenlignes
+    random.seed(scale.name)
+    create_house_database(db_file, scale.floors, scale.rooms, scale.devices)
+    add_measurements(db_file, days=scale.days, interval=scale.interval)
+    build_indexes(db_file)
+    return db_file
+
+
+@pytest.fixture(scope="session")
+def repo(database):
+    repo = SmartHouseRepository(database)
+    yield repo
+    repo.close()
+
+
+@pytest.fixture(scope="session")
+def house(repo):
+    return repo.load_smarthouse_deep()
+
+
+@pytest.fixture(scope="session")
+def room(house):
+    # Et rom midt i huset, med både temperatur- og fuktighetssensor
+    rooms = house.get_rooms()
+    return rooms[len(rooms) // 2]
+
+
+@pytest.fixture(scope="session")
+def sensor(room):
+    return next(d for d in room.devices if d.device_type == "Temperature Sensor")
+
+
+def test_get_device_by_id(benchmark, house):
+    devices = house.get_devices()
+    device = devices[len(devices) // 2]
+    assert benchmark(house.get_device_by_id, device.id) is device
+
+
+def test_get_devices(benchmark, house):
+    assert len(benchmark(house.get_devices)) == house.get_no_devices()
+
+
+def test_get_area(benchmark, house):
+    assert benchmark(house.get_area) > 0
+
+
+def test_load_smarthouse_deep(benchmark, repo, house):
+    assert benchmark(repo.load_smarthouse_deep).get_no_devices() == house.get_no_devices()
+
+
+def test_get_latest_reading(benchmark, repo, sensor):
+    assert benchmark(repo.get_latest_reading, sensor) is not None
+
+
+def test_get_latest_reading_uncached(benchmark, repo, sensor):
+    assert benchmark(repo.fetch_latest_reading, sensor.id) is not None
+
+
+def test_calc_avg_temperatures_in_room(benchmark, repo, room):
+    assert len(benchmark(repo.calc_avg_temperatures_in_room, room, FROM_DATE, UNTIL_DATE)) == 14
+
+
+def test_calc_avg_temperatures_in_rooms(benchmark, repo, house):
+    assert len(benchmark(repo.calc_avg_temperatures_in_rooms, house, FROM_DATE, UNTIL_DATE)) == house.get_no_rooms()
+
+
+def test_calc_hours_with_humidity_above(benchmark, repo, room):
+    assert isinstance(benchmark(repo.calc_hours_with_humidity_above, room, DATE), list)
+
+
+def test_add_measurement(benchmark, repo, sensor):
+    # Skriver langt etter de genererte målingene, så de andre benchmarkene ikke påvirkes
+    seconds = itertools.count()
+
+    def add():
+        ts = datetime(2100, 1, 1) + timedelta(seconds=next(seconds))
+        repo.add_measurement(sensor.id, ts.strftime('%Y-%m-%d %H:%M:%S'), 21.0, "°C")
+
+    benchmark(add)
@@ -0,0 +1,71 @@
+"""
+Compares `calc_hours_with_humidity_above` with the previous f-string version, which
+matched the room by name with `LIKE` and selected the day with `DATE(ts) = ?`.
+Every call asks about a different room, as a building report would.
+
+    python -m benchmarks.humidity_hours --rooms 200 --days 30 --interval 300
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import create_house_database, add_measurements, build_indexes
+from smarthouse.persistence import SmartHouseRepository
+
+
+def legacy_hours_with_humidity_above(repo: SmartHouseRepository, room, date: str) -> list:
+    # Slik spørringen var før den ble parametrisert; ny SQL-tekst for hvert rom
+    query = f"""
+    WITH AverageHumidity AS (
+        SELECT m.device, AVG(m.value) as avg_humidity
+        FROM measurements m
+        INNER JOIN devices d ON m.device = d.id
+        INNER JOIN rooms r ON d.room = r.id
+        WHERE r.name LIKE '{room.room_name}%' AND DATE(m.ts) = ?
+        AND m.unit = '%'
+        GROUP BY m.device
+    )
+    SELECT
+        CAST(strftime('%H', m.ts) AS INTEGER) as hour
+    FROM measurements m
+    INNER JOIN AverageHumidity ah ON m.device = ah.device
+    WHERE DATE(m.ts) = ? AND m.unit = '%'
+    AND m.value > ah.avg_humidity
+    GROUP BY hour
+    HAVING COUNT(*) > 3
+    """
+    return [row[0] for row in repo.conn.execute(query, (date, date))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--interval", type=int, default=300, help="seconds between readings")
+    parser.add_argument("--date", default="2024-01-15")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "house.sql"
+        # to enheter per rom: en temperatur- og en fuktighetssensor
+        create_house_database(db_file, 1, args.rooms, 2)
+        rows = add_measurements(db_file, days=args.days, interval=args.interval)
+        print(f"generated {rows} measurements")
+
+        build_indexes(db_file)
+        repo = SmartHouseRepository(db_file)
+        rooms = repo.load_smarthouse_deep().get_rooms()
+
+        for name, fn in [("f-string, DATE(ts), LIKE", lambda r: legacy_hours_with_humidity_above(repo, r, args.date)),
+                         ("parameterized, ts range, room id", lambda r: repo.calc_hours_with_humidity_above(r, args.date))]:
+            start = time.perf_counter()
+            for room in rooms:
+                fn(room)
+            elapsed = time.perf_counter() - start
+            print(f"{name:34s} {elapsed * 1000 / len(rooms):.3f} ms/room")
+        del repo
+
+
+if __name__ == '__main__':
+    main()
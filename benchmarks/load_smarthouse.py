@@ -0,0 +1,41 @@
+"""
+Measures how long `SmartHouseRepository.load_smarthouse_deep` takes on a synthetic database.
+
+    python -m benchmarks.load_smarthouse --floors 10 --rooms 1000 --devices 10
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import create_house_database
+from smarthouse.persistence import SmartHouseRepository
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--floors", type=int, default=10)
+    parser.add_argument("--rooms", type=int, default=1000, help="rooms per floor")
+    parser.add_argument("--devices", type=int, default=10, help="devices per room")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "house.sql"
+        create_house_database(db_file, args.floors, args.rooms, args.devices)
+        repo = SmartHouseRepository(db_file)
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            house = repo.load_smarthouse_deep()
+            timings.append(time.perf_counter() - start)
+
+        print(f"rooms={house.get_no_rooms()} devices={house.get_no_devices()}")
+        print(f"load_smarthouse_deep: best={min(timings) * 1000:.1f} ms  "
+              f"mean={sum(timings) / len(timings) * 1000:.1f} ms")
+        del repo
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+Load test for the REST API, served by uvicorn in a child process on a seeded copy of the
+demo database. Each scenario gets a fresh copy of the same seeded database and runs for
+`--duration` seconds with `--clients` concurrent clients:
+
+- `ingestion`: sensors posting batches and single readings
+- `dashboard`: dashboards polling the structure, current readings and actuator states
+- `statistics`: temperature reports for floors and the whole house and long histories
+- `mixed`: the cheap reads of the dashboard next to long history streams, which shows
+  whether slow requests hold up the event loop
+
+Throughput, p50/p95/p99 latency and a latency histogram are reported per endpoint; with
+`--output` the results are written as JSON together with the current commit, and
+`--compare` checks them against an earlier file:
+
+    python -m benchmarks.loadtest --duration 10 --output results.json
+    python -m benchmarks.loadtest --duration 10 --compare results.json --max-regression 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+from benchmarks.synthetic import add_measurements
+from smarthouse.persistence import SmartHouseRepository
+
+PROJECT_DIR = Path(__file__).parent.parent
+DEMO_DB = PROJECT_DIR / "data" / "db.sql"
+TEMPERATURE_SENSOR = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+HUMIDITY_SENSOR = "3d87e5c0-8716-4b0b-9c67-087eaaed7b45"
+LIGHT_BULB = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
+HEAT_PUMP = "5e13cabc-5c58-4bb3-82a2-3039e4480a6d"
+SEED_START = "2023-01-01"
+
+# Øvre grenser (ms) for bøttene i latenshistogrammet; siste bøtte tar resten
+HISTOGRAM_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def seed_database(file: Path, days: int, seed: int) -> int:
+    source, target = sqlite3.connect(DEMO_DB), sqlite3.connect(file)
+    source.backup(target)
+    source.close()
+    target.close()
+    rows = add_measurements(file, start=SEED_START, days=days, interval=60, rng=random.Random(seed))
+    # Demodatabasen kan allerede være migrert, og da bygger ikke migreringen aggregater for de
+    # nye målingene; de bygges derfor for tidsrommet som ble fylt
+    last_day = (datetime.fromisoformat(SEED_START) + timedelta(days=days)).strftime('%Y-%m-%d')
+    repo = SmartHouseRepository(file)
+    repo.backfill_rollups(SEED_START, last_day)
+    repo.close()
+    return rows
+
+
+def start_server(db_file: Path, port: int) -> subprocess.Popen:
+    # Serveren kjører i egen prosess slik at klienten ikke konkurrerer om GIL-en
+    env = dict(os.environ, SMARTHOUSE_DB=str(db_file))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "smarthouse.api:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/smarthouse")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def random_day(rng: random.Random, days: int) -> str:
+    return (datetime.fromisoformat(SEED_START) + timedelta(days=rng.randrange(days))).strftime('%Y-%m-%d')
+
+
+def readings(rng: random.Random, n: int):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [{"device": TEMPERATURE_SENSOR, "value": round(rng.uniform(15, 25), 1), "unit": "°C", "timestamp": now}
+            for _ in range(n)]
+
+
+# Hvert scenario er en liste av (vekt, endepunkt, funksjon som lager forespørselen)
+def ingestion(days: int):
+    return [
+        (6, "POST /sensor/measurements:batch", lambda rng: ("POST", "/smarthouse/sensor/measurements:batch", {"json": readings(rng, 50)})),
+        (1, "POST /sensor/measurements:batch?deferred", lambda rng: ("POST", "/smarthouse/sensor/measurements:batch?deferred=true", {"json": readings(rng, 50)})),
+        (3, "POST /sensor/{uuid}/current", lambda rng: ("POST", f"/smarthouse/sensor/{TEMPERATURE_SENSOR}/current", {})),
+    ]
+
+
+def dashboard(days: int):
+    return [
+        (1, "GET /smarthouse", lambda rng: ("GET", "/smarthouse", {})),
+        (1, "GET /floor", lambda rng: ("GET", "/smarthouse/floor", {})),
+        (1, "GET /floor/{fid}/room", lambda rng: ("GET", f"/smarthouse/floor/{rng.choice([1, 2])}/room", {})),
+        (2, "GET /device", lambda rng: ("GET", "/smarthouse/device", {})),
+        (4, "GET /sensor/{uuid}/current", lambda rng: ("GET", f"/smarthouse/sensor/{rng.choice([TEMPERATURE_SENSOR, HUMIDITY_SENSOR])}/current", {})),
+        (2, "GET /actuator/{uuid}/current", lambda rng: ("GET", f"/smarthouse/actuator/{rng.choice([LIGHT_BULB, HEAT_PUMP])}/current", {})),
+        (1, "PUT /actuator/{uuid}", lambda rng: ("PUT", f"/smarthouse/actuator/{LIGHT_BULB}", {"json": {"state": rng.random() < 0.5}})),
+        (2, "GET /sensor/{uuid}/values?limit=50", lambda rng: ("GET", f"/smarthouse/sensor/{TEMPERATURE_SENSOR}/values?limit=50", {})),
+    ]
+
+
+def temperature_statistics(days: int):
+    def window(rng):
+        first = random_day(rng, days)
+        last = (datetime.fromisoformat(first) + timedelta(days=rng.randrange(1, 31))).strftime('%Y-%m-%d')
+        return f"from_date={first}&until_date={last}"
+    return [
+        (3, "GET /floor/{fid}/stats/temperature", lambda rng: ("GET", f"/smarthouse/floor/{rng.choice([1, 2])}/stats/temperature?{window(rng)}", {})),
+        (2, "GET /stats/temperature", lambda rng: ("GET", f"/smarthouse/stats/temperature?{window(rng)}", {})),
+        (1, "GET /sensor/{uuid}/values?limit=5000", lambda rng: ("GET", f"/smarthouse/sensor/{HUMIDITY_SENSOR}/values?limit=5000", {})),
+    ]
+
+
+def mixed(days: int):
+    return [
+        (4, "GET /sensor/{uuid}/current", lambda rng: ("GET", f"/smarthouse/sensor/{TEMPERATURE_SENSOR}/current", {})),
+        (4, "GET /device/{uuid}", lambda rng: ("GET", f"/smarthouse/device/{LIGHT_BULB}", {})),
+        (1, "GET /sensor/{uuid}/values?format=ndjson", lambda rng: ("GET", f"/smarthouse/sensor/{HUMIDITY_SENSOR}/values?limit=20000&format=ndjson", {})),
+    ]
+
+
+SCENARIOS = {"ingestion": ingestion, "dashboard": dashboard, "statistics": temperature_statistics, "mixed": mixed}
+
+
+async def worker(client: httpx.AsyncClient, requests, rng: random.Random, deadline: float, latencies, errors):
+    weights = [weight for weight, _, _ in requests]
+    while time.perf_counter() < deadline:
+        _, name, build = rng.choices(requests, weights)[0]
+        method, path, kwargs = build(rng)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        latencies[name].append(time.perf_counter() - start)
+        if not ok:
+            errors[name] += 1
+
+
+async def run_scenario(base_url: str, requests, duration: float, clients: int, seed: int):
+    latencies, errors = defaultdict(list), defaultdict(int)
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[worker(client, requests, random.Random(seed + i), deadline, latencies, errors)
+                               for i in range(clients)])
+    return latencies, errors
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def histogram(values_ms):
+    counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for value in values_ms:
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return [[bound, count] for bound, count in zip(HISTOGRAM_BOUNDS + [None], counts)]
+
+
+def summarize(latencies, errors, duration: float) -> dict:
+    endpoints = {}
+    for name, values in sorted(latencies.items()):
+        values_ms = [v * 1000 for v in values]
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": errors.get(name, 0),
+            "throughput": len(values) / duration,
+            "mean_ms": sum(values_ms) / len(values_ms),
+            "p50_ms": percentile(values_ms, 50),
+            "p95_ms": percentile(values_ms, 95),
+            "p99_ms": percentile(values_ms, 99),
+            "max_ms": max(values_ms),
+            "histogram_ms": histogram(values_ms),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {"requests": total, "throughput": total / duration, "endpoints": endpoints}
+
+
+def print_scenario(name: str, result: dict):
+    print(f"\n{name}: {result['requests']} requests, {result['throughput']:.1f} req/s")
+    print(f"  {'endpoint':42s} {'requests':>9s} {'errors':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for endpoint, s in result["endpoints"].items():
+        print(f"  {endpoint:42s} {s['requests']:9d} {s['errors']:7d} {s['throughput']:8.1f} "
+              f"{s['p50_ms']:8.2f} {s['p95_ms']:8.2f} {s['p99_ms']:8.2f}")
+
+
+def compare(previous: dict, current: dict, max_regression: float) -> bool:
+    """
+    Prints the change in throughput and p99 per endpoint and returns False if any endpoint
+    got more than `max_regression` percent worse in either.
+    """
+    ok = True
+    print(f"\ncompared with {previous.get('commit', '?')[:12]}:")
+    for scenario, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        for endpoint, s in result["endpoints"].items():
+            old = before["endpoints"].get(endpoint)
+            if not old:
+                continue
+            if not old["throughput"] or not old["p99_ms"]:
+                # Ingen grunnlinje å regne prosent mot
+                print(f"  {scenario}/{endpoint}: no baseline")
+                continue
+            throughput = (s["throughput"] / old["throughput"] - 1) * 100
+            p99 = (s["p99_ms"] / old["p99_ms"] - 1) * 100
+            regressed = throughput < -max_regression or p99 > max_regression
+            ok = ok and not regressed
+            print(f"  {'REGRESSION ' if regressed else ''}{scenario}/{endpoint}: throughput {throughput:+.1f}%, p99 {p99:+.1f}%")
+    return ok
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable); all by default")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--days", type=int, default=30, help="days of per-minute readings to seed")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the data and the request mix")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="percent by which throughput or p99 may get worse before --compare fails")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    results = {
+        "commit": git_commit(),
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"duration": args.duration, "clients": args.clients, "days": args.days, "seed": args.seed},
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        template = Path(tmp) / "seeded.sql"
+        print(f"seeded {seed_database(template, args.days, args.seed)} measurements")
+        for name in scenarios:
+            # Hvert scenario starter fra den samme databasen
+            db_file = Path(tmp) / f"{name}.sql"
+            source, target = sqlite3.connect(template), sqlite3.connect(db_file)
+            source.backup(target)
+            source.close()
+            target.close()
+            server = start_server(db_file, args.port)
+            try:
+                latencies, errors = asyncio.run(run_scenario(f"http://127.0.0.1:{args.port}", SCENARIOS[name](args.days),
+                                                             args.duration, args.clients, args.seed))
+            finally:
+                server.terminate()
+                server.wait()
+            results["scenarios"][name] = summarize(latencies, errors, args.duration)
+            print_scenario(name, results["scenarios"][name])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(json.load(f), results, args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
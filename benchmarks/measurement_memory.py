@@ -0,0 +1,61 @@
+"""
+Compares the memory used per reading by the previous `Measurement` (with a `__dict__`),
+the slotted `Measurement` and the columnar `MeasurementSeries`.
+
+    python -m benchmarks.measurement_memory --readings 1000000
+"""
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+from smarthouse.domain import Measurement, MeasurementSeries, timestamp_to_epoch
+
+
+class DictMeasurement:
+    # Slik Measurement var før __slots__
+    def __init__(self, timestamp: str, value: float, unit: str) -> None:
+        self.timestamp = timestamp
+        self.value = value
+        self.unit = unit
+
+
+def rows(n: int):
+    start = datetime(2024, 1, 1)
+    for i in range(n):
+        yield (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'), 20.0 + (i % 100) / 10, "°C"
+
+
+def measured(build, n: int) -> float:
+    # Radene lages mens målingen pågår, som når de leses fra databasen; midlertidige
+    # strenger som frigjøres igjen telles ikke med
+    tracemalloc.start()
+    result = build(rows(n))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size / n
+
+
+def as_series(data):
+    series = MeasurementSeries("sensor", "°C")
+    for ts, value, _ in data:
+        series.append(timestamp_to_epoch(ts), value)
+    return series
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    cases = [
+        ("Measurement with __dict__", lambda data: [DictMeasurement(*row) for row in data]),
+        ("Measurement with __slots__", lambda data: [Measurement(*row) for row in data]),
+        ("MeasurementSeries", as_series),
+    ]
+    for name, build in cases:
+        print(f"{name:28s} {measured(build, args.readings):7.1f} bytes/reading")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the pydantic response path of `/smarthouse/device` and `/smarthouse/sensor/{uuid}/values`
+(one model per item, validated again through `response_model`) with the direct encoders in
+`smarthouse.serialization`.
+
+    python -m benchmarks.serialization --devices 10000 --measurements 100000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from random import uniform
+from typing import List
+
+from pydantic import TypeAdapter
+
+from smarthouse import serialization
+from smarthouse.domain import Actuator, Measurement, Sensor
+from smarthouse.models import ActuatorModel, DeviceModel, MeasurementModel, SensorModel
+
+DEVICE_ID = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+
+
+def make_devices(n: int):
+    devices = []
+    for i in range(n):
+        if i % 2:
+            devices.append(Sensor(f"sensor-{i}", "TermoTech 1000", "Elysian Tech", "Temperature Sensor", "°C"))
+        else:
+            devices.append(Actuator(f"actuator-{i}", "Lumina Glow 4000", "Elysian Tech", "Light Bulp"))
+    return devices
+
+
+def make_measurements(n: int):
+    start = datetime(2024, 1, 1)
+    return [Measurement((start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'), round(uniform(15, 25), 1), "°C")
+            for i in range(n)]
+
+
+def pydantic_devices(devices, adapter: TypeAdapter) -> bytes:
+    # Slik endepunktet gjorde det: én modell per enhet, som FastAPI så dumper og validerer mot response_model
+    models = []
+    for device in devices:
+        if isinstance(device, Sensor):
+            models.append(SensorModel(id=device.id, kind=device.device_type, supplier=device.supplier,
+                                      product=device.model_name, unit=device.unit))
+        else:
+            models.append(ActuatorModel(id=device.id, kind=device.device_type, supplier=device.supplier,
+                                        product=device.model_name, state=device.state))
+    return adapter.dump_json(adapter.validate_python([model.model_dump() for model in models]))
+
+
+def pydantic_measurements(measurements, adapter: TypeAdapter) -> bytes:
+    models = [MeasurementModel(device=DEVICE_ID, timestamp=m.timestamp, value=m.value, unit=m.unit) for m in measurements]
+    return adapter.dump_json(adapter.validate_python([model.model_dump() for model in models]))
+
+
+def throughput(fn, items: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return items / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--measurements", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    devices = make_devices(args.devices)
+    measurements = make_measurements(args.measurements)
+    device_adapter = TypeAdapter(List[DeviceModel])
+    measurement_adapter = TypeAdapter(List[MeasurementModel])
+
+    print(f"encoder: {'orjson' if serialization.orjson is not None else 'json'}")
+    cases = [
+        ("devices", args.devices,
+         lambda: pydantic_devices(devices, device_adapter),
+         lambda: serialization.encode_devices(devices)),
+        ("measurements", args.measurements,
+         lambda: pydantic_measurements(measurements, measurement_adapter),
+         lambda: serialization.encode_measurements(DEVICE_ID, measurements)),
+    ]
+    for name, items, slow, fast in cases:
+        slow_rate = throughput(slow, items, args.repeat)
+        fast_rate = throughput(fast, items, args.repeat)
+        print(f"{name:12s} pydantic={slow_rate:12,.0f}/s  direct={fast_rate:12,.0f}/s  speedup={fast_rate / slow_rate:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
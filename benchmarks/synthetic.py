@@ -0,0 +1,197 @@
+"""
+Generates schema-compatible SmartHouse databases of any size for benchmarks.
+
+    python -m benchmarks.synthetic house.sql --floors 10 --rooms 100 --devices 10 --days 365 --interval 60
+    python -m benchmarks.synthetic house.sql --rooms 20 --measurements-per-device 1000000 --days 30
+
+Temperature and humidity sensors get one reading every `--interval` seconds over `--days`
+days (or `--measurements-per-device` readings spread over that span). Rows are written with
+`executemany` in large transactions with journaling relaxed for the bulk load; the indexes
+and rollup tables are built once afterwards by the regular schema migrations, which is much
+faster than maintaining them row by row. With `--seed` the same database is produced every time.
+"""
+import argparse
+import math
+import random
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Optional
+
+# Skjemaet hentes fra demo-databasen slik at syntetiske databaser alltid er kompatible
+SCHEMA_SOURCE = Path(__file__).parent.parent / "data" / "db.sql"
+
+DEVICE_KINDS = [
+    ("Temperature Sensor", "sensor"),
+    ("Humidity Sensor", "sensor"),
+    ("Light Bulp", "actuator"),
+    ("Smart Plug", "actuator"),
+]
+
+# Enhet og (grunnverdi, amplitude) for de sensortypene som får målinger
+SENSOR_SIGNALS = {
+    "Temperature Sensor": ("°C", 21.0, 3.0),
+    "Humidity Sensor": ("%", 50.0, 20.0),
+}
+
+# Innstillinger for bulk-lasting: ingen fsync og rollback-journal i minnet. En krasj under
+# generering kan ødelegge filen, men den lages jo bare på nytt.
+BULK_PRAGMAS = """
+    PRAGMA journal_mode = MEMORY;
+    PRAGMA synchronous = OFF;
+    PRAGMA cache_size = -262144;
+    PRAGMA temp_store = MEMORY;
+"""
+
+
+def copy_schema(conn: sqlite3.Connection):
+    """
+    Creates the tables of the demo database in the given (empty) database.
+    """
+    source = sqlite3.connect(SCHEMA_SOURCE)
+    tables = source.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE type = 'table' AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+    """).fetchall()
+    source.close()
+    for (sql,) in tables:
+        conn.execute(sql)
+
+
+def random_uuid() -> str:
+    # Fra `random` i stedet for uuid4, slik at random.seed gir de samme id-ene hver gang
+    return str(uuid.UUID(int=random.getrandbits(128), version=4))
+
+
+def create_house_database(file, no_floors: int = 10, rooms_per_floor: int = 100, devices_per_room: int = 10):
+    """
+    Creates a SQLite database at the given path containing a synthetic house with the given
+    number of floors, rooms and devices. Every other actuator is stored as turned on.
+    """
+    conn = sqlite3.connect(file)
+    copy_schema(conn)
+
+    rooms = []
+    devices = []
+    states = []
+    for floor in range(1, no_floors + 1):
+        for r in range(rooms_per_floor):
+            room_id = len(rooms) + 1
+            rooms.append((room_id, floor, 10.0 + r % 20, f"Room {floor}.{r}"))
+            for d in range(devices_per_room):
+                kind, category = DEVICE_KINDS[d % len(DEVICE_KINDS)]
+                device_id = random_uuid()
+                devices.append((device_id, room_id, kind, category, "Synthetic Inc.", f"Model {d}"))
+                if category == "actuator":
+                    states.append((device_id, 'True' if len(states) % 2 else 'False'))
+
+    conn.executemany("INSERT INTO rooms (id, floor, area, name) VALUES (?, ?, ?, ?)", rooms)
+    conn.executemany("INSERT INTO devices (id, room, kind, category, supplier, product) VALUES (?, ?, ?, ?, ?, ?)", devices)
+    conn.executemany("INSERT INTO states (device, state) VALUES (?, ?)", states)
+    conn.commit()
+    conn.close()
+
+
+def generate_measurements(devices, start: datetime, days: int, interval: float, steps: Optional[int] = None,
+                          rng: Optional[random.Random] = None):
+    """
+    Yields `(device, ts, value, unit)` rows for each `(device_id, kind)` in `devices`,
+    one every `interval` seconds for the given number of days (or `steps` readings per
+    device), ordered by time. The noise is drawn from `rng`, or from `random` without it.
+    """
+    if steps is None:
+        steps = int(days * 24 * 3600 // interval)
+    signals = [(device_id,) + SENSOR_SIGNALS[kind] for device_id, kind in devices]
+    noise = (rng or random).random
+    for step in range(steps):
+        offset = step * interval
+        ts = (start + timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S')
+        # Døgnvariasjon pluss litt støy
+        phase = math.sin(2 * math.pi * (offset % 86400) / 86400)
+        for device_id, unit, base, amplitude in signals:
+            yield device_id, ts, round(base + amplitude * phase + noise() - 0.5, 2), unit
+
+
+def add_measurements(file, start: str = "2024-01-01", days: int = 365, interval: float = 60, chunk_size: int = 100_000,
+                     measurements_per_device: Optional[int] = None, rng: Optional[random.Random] = None) -> int:
+    """
+    Fills the database with synthetic readings for every temperature and humidity sensor.
+    With `measurements_per_device`, that many readings are spread evenly over `days` days
+    instead of one every `interval` seconds. Rows are inserted in chunks of `chunk_size`
+    per transaction. Returns the number of rows.
+    """
+    if measurements_per_device:
+        interval = days * 86400 / measurements_per_device
+    conn = sqlite3.connect(file)
+    conn.executescript(BULK_PRAGMAS)
+    devices = conn.execute(
+        f"SELECT id, kind FROM devices WHERE kind IN ({', '.join('?' * len(SENSOR_SIGNALS))})",
+        list(SENSOR_SIGNALS)).fetchall()
+    rows = generate_measurements(devices, datetime.fromisoformat(start), days, interval, measurements_per_device, rng)
+    total = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        conn.executemany("INSERT INTO measurements (device, ts, value, unit) VALUES (?, ?, ?, ?)", chunk)
+        conn.commit()
+        total += len(chunk)
+    conn.close()
+    return total
+
+
+def build_indexes(file):
+    """
+    Runs the schema migrations (indexes and rollup tables) and the rollup backfill on a
+    freshly loaded database.
+    """
+    from smarthouse.persistence import SmartHouseRepository
+    repo = SmartHouseRepository(file)
+    repo.backfill_pending_rollups()
+    repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="database file to create (must not exist)")
+    parser.add_argument("--floors", type=int, default=10)
+    parser.add_argument("--rooms", type=int, default=100, help="rooms per floor")
+    parser.add_argument("--devices", type=int, default=10, help="devices per room (half of them sensors)")
+    parser.add_argument("--start", default="2024-01-01", help="date of the first reading")
+    parser.add_argument("--days", type=int, default=365, help="time span of the readings")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between readings of a sensor")
+    parser.add_argument("--measurements-per-device", type=int, default=None,
+                        help="readings per sensor, spread over --days (overrides --interval)")
+    parser.add_argument("--chunk-size", type=int, default=500_000, help="rows per transaction")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible ids and values")
+    parser.add_argument("--no-indexes", action="store_true",
+                        help="leave indexes and rollups to the first SmartHouseRepository that opens the file")
+    args = parser.parse_args()
+
+    if Path(args.file).exists():
+        parser.error(f"{args.file} already exists")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    started = time.perf_counter()
+    create_house_database(args.file, args.floors, args.rooms, args.devices)
+    print(f"house: {args.floors} floors, {args.floors * args.rooms} rooms, "
+          f"{args.floors * args.rooms * args.devices} devices")
+
+    start = time.perf_counter()
+    rows = add_measurements(args.file, args.start, args.days, args.interval, args.chunk_size, args.measurements_per_device)
+    elapsed = time.perf_counter() - start
+    print(f"measurements: {rows:,} rows in {elapsed:.1f} s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    if not args.no_indexes:
+        start = time.perf_counter()
+        build_indexes(args.file)
+        print(f"indexes and rollups: {time.perf_counter() - start:.1f} s")
+    print(f"total: {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,8 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
 LIGHTBULB_DID = "6b1c5f6b-37f6-4e3d-9145-1cfbe2f1fc28"
 TEMPERATURE_SENSOR_DID = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
 
@@ -5,11 +10,38 @@ TEMPERATURE_SENSOR_DID = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
 BASE_URL = "http://localhost:8000/smarthouse/"
 
 LIGHTBULB_SIMULATOR_SLEEP_TIME = 1
+# ventetid før klienten kobler seg til hendelsesstrømmen på nytt etter en feil
 LIGHTBULB_CLIENT_SLEEP_TIME = 4
 
 TEMPERATURE_SENSOR_SIMULATOR_SLEEP_TIME = 2
 TEMPERATURE_SENSOR_CLIENT_SLEEP_TIME = 4
 
+# målingene samles opp og sendes samlet til measurements:batch når det har gått
+# FLUSH_INTERVAL sekunder siden forrige sending, eller BATCH_SIZE målinger venter
+TEMPERATURE_SENSOR_FLUSH_INTERVAL = 10
+TEMPERATURE_SENSOR_BATCH_SIZE = 50
+# målinger som ikke kan sendes beholdes til neste forsøk, men ikke flere enn dette
+TEMPERATURE_SENSOR_MAX_BUFFERED = 1000
+
 TEMP_RANGE = 40
 
+# antall keep-alive-forbindelser den felles sesjonen holder åpne mot skyen
+SESSION_POOL_SIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+
 
+def session() -> requests.Session:
+    """
+    The HTTP session shared by all clients in this process. Connections are kept
+    alive and reused across requests and threads instead of opened per request.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SESSION_POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
@@ -25,9 +25,9 @@ def lightbulb_cmd(state, did):
 
     # Send the PUT request with the new state to the cloud service
     try:
-        response = requests.put(put_url,
-                                data=payload,
-                                headers={'Content-Type': 'application/json'})
+        response = common.session().put(put_url,
+                                         data=payload,
+                                         headers={'Content-Type': 'application/json'})
         response.raise_for_status()
 
         # Log the successful state update
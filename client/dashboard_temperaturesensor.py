@@ -1,7 +1,11 @@
 import tkinter as tk
 from tkinter import ttk
 
+import json
 import logging
+import queue
+import threading
+import time
 import requests
 
 from messaging import SensorMeasurement
@@ -14,7 +18,7 @@ def refresh_btn_cmd(temp_widget, did):
 
     try:
         # Make the API call to fetch the current temperature
-        r = requests.get(f"{common.BASE_URL}sensor/{did}/current")
+        r = common.session().get(f"{common.BASE_URL}sensor/{did}/current")
         r.raise_for_status()  # Check for HTTP errors
         data = r.json()
 
@@ -23,15 +27,46 @@ def refresh_btn_cmd(temp_widget, did):
         sensor_measurement = SensorMeasurement(init_value=str(data['value']))
 
         # Update the GUI with the new temperature
-        temp_widget['state'] = 'normal'
-        temp_widget.delete(1.0, tk.END)
-        temp_widget.insert(tk.END, f"{sensor_measurement.value} °C")
-        temp_widget['state'] = 'disabled'
+        show_temperature(temp_widget, sensor_measurement.value)
 
     except requests.RequestException as e:
         logging.error(f"Error refreshing temperature: {e}")
 
 
+def show_temperature(temp_widget, value):
+    temp_widget['state'] = 'normal'
+    temp_widget.delete(1.0, tk.END)
+    temp_widget.insert(tk.END, f"{value} °C")
+    temp_widget['state'] = 'disabled'
+
+
+def listen_for_measurements(did, measurements):
+    # Lytter på nye målinger fra skyen (SSE) i en egen tråd; tkinter-widgeten
+    # oppdateres bare fra hovedtråden via køen
+    while True:
+        try:
+            with common.session().get(f"{common.BASE_URL}events", params={'device': did},
+                                      stream=True, timeout=(5, None)) as events:
+                events.raise_for_status()
+                for line in events.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:'):
+                        event = json.loads(line[len('data:'):])
+                        if event.get('type') == 'measurement':
+                            measurements.put(event['value'])
+        except requests.RequestException as e:
+            logging.error(f"Error listening for temperature updates: {e}")
+        time.sleep(common.LIGHTBULB_CLIENT_SLEEP_TIME)
+
+
+def poll_measurements(temp_widget, measurements):
+    try:
+        while True:
+            show_temperature(temp_widget, measurements.get_nowait())
+    except queue.Empty:
+        pass
+    temp_widget.after(500, poll_measurements, temp_widget, measurements)
+
+
 def init_temperature_sensor(container, did):
 
     ts_lf = ttk.LabelFrame(container, text=f'Temperature sensor [{did}]')
@@ -48,3 +83,8 @@ def init_temperature_sensor(container, did):
                                 command=lambda: refresh_btn_cmd(temp, did))
 
     refresh_button.grid(column=1, row=0, padx=20, pady=20)
+
+    # nye målinger vises automatisk; Refresh-knappen kan fortsatt brukes
+    measurements = queue.Queue()
+    threading.Thread(target=listen_for_measurements, args=(did, measurements), daemon=True).start()
+    poll_measurements(temp, measurements)
@@ -0,0 +1,265 @@
+"""
+Simulates a whole fleet of sensors and actuators from one asyncio event loop, instead of
+two threads per device as in `smarthouse.py`. The devices are read from a manifest, either
+a CSV file with the columns of `tests/Bookofmormons.csv` or the `devices` table of a
+SmartHouse database:
+
+    python fleet.py --manifest ../tests/Bookofmormons.csv
+    python fleet.py --database ../data/db.sql --interval 0.5 --duration 60
+
+Sensors produce a reading every `--interval` seconds; the readings of the whole fleet are
+sent together to `measurements:batch` (see the TEMPERATURE_SENSOR_* batch settings in
+`common.py`), with up to `--connections` requests in flight. Actuators follow their state
+through one shared event stream and can additionally poll it (`--poll-interval`). With a
+short interval and many devices the fleet works as a load generator for the API.
+
+Requires httpx (`pip install httpx`).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import math
+import random
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+import common
+
+# Enhet og (grunnverdi, amplitude) for sensortypene som sender målinger
+SENSOR_SIGNALS = {
+    "Temperature Sensor": ("°C", 21.0, 3.0),
+    "Humidity Sensor": ("%", 50.0, 20.0),
+    "Electricity Meter": ("kWh", 10.0, 5.0),
+    "CO2 sensor": ("ppm", 600.0, 200.0),
+}
+
+
+class DeviceSpec:
+
+    def __init__(self, did: str, kind: str, category: str):
+        self.did = did
+        self.kind = kind
+        self.category = category.lower()
+
+
+def read_csv_manifest(path) -> List[DeviceSpec]:
+    # utf-8-sig: manifestet kan begynne med en BOM
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return [DeviceSpec(row['Identifikator'], row['Enhet'], row['DeviceCategory']) for row in csv.DictReader(f)]
+
+
+def read_database_manifest(path) -> List[DeviceSpec]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return [DeviceSpec(*row) for row in conn.execute("SELECT id, kind, category FROM devices ORDER BY rowid")]
+    finally:
+        conn.close()
+
+
+class FleetStats:
+
+    def __init__(self):
+        self.readings = 0
+        self.requests = 0
+        self.errors = 0
+        self.state_changes = 0
+
+    def report(self, elapsed: float) -> str:
+        return (f"{elapsed:6.1f} s: {self.readings} readings in {self.requests} requests "
+                f"({self.readings / max(elapsed, 1e-9):.0f} readings/s), {self.errors} errors, "
+                f"{self.state_changes} actuator state changes")
+
+
+class SensorSimulator:
+
+    def __init__(self, spec: DeviceSpec, fleet: "Fleet"):
+        self.did = spec.did
+        self.unit, self.base, self.amplitude = SENSOR_SIGNALS[spec.kind]
+        self.fleet = fleet
+        self.phase = random.uniform(0, 2 * math.pi)
+
+    def read(self) -> float:
+        return round(self.base + self.amplitude * math.sin(time.time() / 600 + self.phase), 2)
+
+    async def run(self):
+        # Sprer sensorene utover intervallet slik at ikke alle måler samtidig
+        await asyncio.sleep(random.uniform(0, self.fleet.interval))
+        while True:
+            self.fleet.buffer_reading(self.did, self.read(), self.unit)
+            await asyncio.sleep(self.fleet.interval)
+
+
+class ActuatorSimulator:
+
+    def __init__(self, spec: DeviceSpec, fleet: "Fleet"):
+        self.did = spec.did
+        self.fleet = fleet
+        self.state = False
+
+    def set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.fleet.stats.state_changes += 1
+            logging.debug(f"Actuator {self.did} state: {state}")
+
+    async def fetch_state(self):
+        response = await self.fleet.request("GET", f"actuator/{self.did}/current")
+        if response is not None:
+            self.set_state(response.json()['state'])
+
+    async def run(self):
+        await self.fetch_state()
+        if not self.fleet.poll_interval:
+            return
+        await asyncio.sleep(random.uniform(0, self.fleet.poll_interval))
+        while True:
+            await self.fetch_state()
+            await asyncio.sleep(self.fleet.poll_interval)
+
+
+class Fleet:
+
+    def __init__(self, devices: List[DeviceSpec], base_url: str = common.BASE_URL, interval: float = 2.0,
+                 flush_interval: float = common.TEMPERATURE_SENSOR_FLUSH_INTERVAL,
+                 batch_size: int = common.TEMPERATURE_SENSOR_BATCH_SIZE,
+                 poll_interval: Optional[float] = None, connections: int = common.SESSION_POOL_SIZE,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.connections = connections
+        # Settes i testene for å kjøre mot API-et i samme prosess (httpx.ASGITransport)
+        self.transport = transport
+        self.stats = FleetStats()
+        self.sensors = [SensorSimulator(d, self) for d in devices if d.category == 'sensor' and d.kind in SENSOR_SIGNALS]
+        self.actuators: Dict[str, ActuatorSimulator] = {d.did: ActuatorSimulator(d, self) for d in devices if d.category == 'actuator'}
+        self.buffer = []
+        # Sendinger som ikke er ferdige; de må fullføres før klienten lukkes
+        self.pending = set()
+        self.batch_ready = asyncio.Event()
+        self.in_flight = asyncio.Semaphore(connections)
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def buffer_reading(self, did: str, value: float, unit: str):
+        self.buffer.append({"device": did, "value": value, "unit": unit,
+                            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        if len(self.buffer) >= self.batch_size:
+            self.batch_ready.set()
+
+    async def request(self, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        async with self.in_flight:
+            try:
+                response = await self.client.request(method, path, **kwargs)
+                response.raise_for_status()
+                self.stats.requests += 1
+                return response
+            except httpx.HTTPError as e:
+                self.stats.errors += 1
+                logging.error(f"{method} {path} failed: {e!r}")
+                return None
+
+    async def send(self, batch):
+        if await self.request("POST", "sensor/measurements:batch", json=batch) is not None:
+            self.stats.readings += len(batch)
+
+    def flush(self):
+        # Sender i biter på batch_size, flere samtidig, uten å vente på at forrige er ferdig
+        while self.buffer:
+            batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+            task = asyncio.create_task(self.send(batch))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            self.flush()
+
+    async def listen(self):
+        # Én felles hendelsesstrøm for alle aktuatorene i stedet for én forbindelse per enhet
+        while True:
+            try:
+                async with self.client.stream("GET", "events", timeout=httpx.Timeout(5, read=None)) as events:
+                    events.raise_for_status()
+                    async for line in events.aiter_lines():
+                        if line.startswith('data:'):
+                            event = json.loads(line[len('data:'):])
+                            actuator = self.actuators.get(event.get('device'))
+                            if actuator and event.get('type') == 'actuator':
+                                actuator.set_state(event['state'])
+            except httpx.HTTPError as e:
+                logging.error(f"Event stream failed: {e!r}")
+            await asyncio.sleep(common.LIGHTBULB_CLIENT_SLEEP_TIME)
+
+    async def reporter(self, started: float, every: float = 5.0):
+        while True:
+            await asyncio.sleep(every)
+            logging.info(self.stats.report(time.perf_counter() - started))
+
+    async def run(self, duration: Optional[float] = None):
+        logging.info(f"Simulating {len(self.sensors)} sensors and {len(self.actuators)} actuators")
+        limits = httpx.Limits(max_connections=self.connections + 1, max_keepalive_connections=self.connections + 1)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30,
+                                     transport=self.transport) as self.client:
+            started = time.perf_counter()
+            tasks = [asyncio.create_task(self.flusher()), asyncio.create_task(self.reporter(started))]
+            if self.actuators:
+                tasks.append(asyncio.create_task(self.listen()))
+            tasks += [asyncio.create_task(s.run()) for s in self.sensors]
+            tasks += [asyncio.create_task(a.run()) for a in self.actuators.values()]
+            try:
+                await asyncio.wait(tasks, timeout=duration)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                # Det som ligger igjen i bufferen sendes, og alle sendinger fullføres, før klienten lukkes
+                self.flush()
+                await asyncio.gather(*self.pending, return_exceptions=True)
+            logging.info(self.stats.report(time.perf_counter() - started))
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV file with Identifikator, Enhet and DeviceCategory columns")
+    source.add_argument("--database", help="SmartHouse database whose devices table is simulated")
+    parser.add_argument("--base-url", default=common.BASE_URL)
+    parser.add_argument("--interval", type=float, default=common.TEMPERATURE_SENSOR_SIMULATOR_SLEEP_TIME,
+                        help="seconds between readings of each sensor")
+    parser.add_argument("--flush-interval", type=float, default=common.TEMPERATURE_SENSOR_FLUSH_INTERVAL)
+    parser.add_argument("--batch-size", type=int, default=common.TEMPERATURE_SENSOR_BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=None,
+                        help="let every actuator also poll its state this often (seconds)")
+    parser.add_argument("--connections", type=int, default=common.SESSION_POOL_SIZE,
+                        help="maximum number of requests in flight")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    # httpx logger hver forespørsel på INFO-nivå
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    devices = read_csv_manifest(args.manifest) if args.manifest else read_database_manifest(args.database)
+    fleet = Fleet(devices, args.base_url, args.interval, args.flush_interval, args.batch_size,
+                  args.poll_interval, args.connections)
+    try:
+        asyncio.run(fleet.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
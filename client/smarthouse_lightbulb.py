@@ -1,3 +1,4 @@
+import json
 import logging
 import threading
 import time
@@ -23,25 +24,40 @@ class Actuator:
 
             time.sleep(common.LIGHTBULB_SIMULATOR_SLEEP_TIME)
 
+    def set_state(self, state):
+        # Convert 1/0 to True/False
+        received_state = bool(state)
+        # Update the ActuatorState instance
+        self.state.state = str(received_state).lower()
+        logging.info(f"Updated actuator {self.did} state to: {'On' if received_state else 'Off'}")
+
     def client(self):
 
         logging.info(f"Actuator Client {self.did} starting")
+        # Henter tilstanden én gang, og lytter deretter på endringer som skyen sender (SSE)
+        # i stedet for å spørre med faste intervaller
         while True:
             try:
-                r = requests.get(f"{common.BASE_URL}actuator/{self.did}/current")
+                r = common.session().get(f"{common.BASE_URL}actuator/{self.did}/current")
                 r.raise_for_status()
                 data = r.json()
 
                 if 'state' in data:
-                    # Convert 1/0 to True/False
-                    received_state = bool(data['state'])
-                    # Update the ActuatorState instance
-                    self.state.state = str(received_state).lower()
-                    logging.info(f"Updated actuator {self.did} state to: {'On' if received_state else 'Off'}")
+                    self.set_state(data['state'])
+
+                with common.session().get(f"{common.BASE_URL}events", params={'device': self.did},
+                                          stream=True, timeout=(5, None)) as events:
+                    events.raise_for_status()
+                    for line in events.iter_lines(decode_unicode=True):
+                        if line and line.startswith('data:'):
+                            event = json.loads(line[len('data:'):])
+                            if event.get('type') == 'actuator':
+                                self.set_state(event['state'])
 
             except requests.RequestException as e:
                 logging.error(f"Error fetching state for Actuator {self.did}: {e}")
 
+            # Forbindelsen ble brutt; prøver igjen etter en liten pause
             time.sleep(common.LIGHTBULB_CLIENT_SLEEP_TIME)
         # TODO: END
 
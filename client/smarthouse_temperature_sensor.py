@@ -2,6 +2,9 @@ import logging
 import threading
 import time
 import math
+from collections import deque
+from datetime import datetime
+
 import requests
 
 from messaging import SensorMeasurement
@@ -13,6 +16,54 @@ class Sensor:
     def __init__(self, did):
         self.did = did
         self.measurement = SensorMeasurement('0.0')
+        # Målinger som venter på å bli sendt; de eldste forkastes hvis skyen er utilgjengelig lenge
+        self.buffer = deque(maxlen=common.TEMPERATURE_SENSOR_MAX_BUFFERED)
+        self.buffer_changed = threading.Condition()
+
+    def buffer_reading(self, value: float):
+        with self.buffer_changed:
+            self.buffer.append({
+                "device": self.did,
+                "value": value,
+                "unit": self.measurement.unit,
+                "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            })
+            if len(self.buffer) >= common.TEMPERATURE_SENSOR_BATCH_SIZE:
+                self.buffer_changed.notify()
+
+    def flush(self) -> bool:
+        """
+        Sends the buffered readings in one request. Readings that could not be sent because
+        of a connection error or a server error (5xx) stay in the buffer for the next attempt;
+        a batch the service rejects (4xx) is dropped, since resending it would fail again.
+        """
+        with self.buffer_changed:
+            batch = list(self.buffer)
+        if not batch:
+            return True
+        try:
+            response = common.session().post(f"{common.BASE_URL}sensor/measurements:batch", json=batch)
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            if e.response is not None and 400 <= e.response.status_code < 500:
+                logging.error(f"Dropping {len(batch)} temperature readings for sensor {self.did} rejected by the service: {e}")
+                self.discard(batch)
+                return True
+            logging.error(f"Error sending {len(batch)} temperature readings for sensor {self.did}: {e}")
+            return False
+        except requests.RequestException as e:
+            logging.error(f"Error sending {len(batch)} temperature readings for sensor {self.did}: {e}")
+            return False
+        self.discard(batch)
+        logging.info(f"Successfully sent {len(batch)} temperature readings for sensor {self.did}")
+        return True
+
+    def discard(self, batch: list):
+        sent = {id(reading) for reading in batch}
+        with self.buffer_changed:
+            # Bufferen kan ha forkastet de eldste målingene i mellomtiden, så det fjernes bare det som faktisk ble sendt
+            while self.buffer and id(self.buffer[0]) in sent:
+                self.buffer.popleft()
 
     def simulator(self):
 
@@ -24,6 +75,7 @@ class Sensor:
 
             logging.info(f"Sensor {self.did}: {temp}")
             self.measurement.set_temperature(str(temp))
+            self.buffer_reading(temp)
 
             time.sleep(common.TEMPERATURE_SENSOR_SIMULATOR_SLEEP_TIME)
 
@@ -33,20 +85,14 @@ class Sensor:
 
         # TODO: START
         # send temperature to the cloud service with regular intervals
+        # Målingene sendes samlet over den felles keep-alive-sesjonen, enten etter
+        # TEMPERATURE_SENSOR_FLUSH_INTERVAL sekunder eller når en full batch venter
         while True:
-            payload = self.measurement.to_json()
-
-            try:
-                response = requests.post(f"{common.BASE_URL}sensor/{self.did}/current",
-                                         json=payload,  # Ensure payload is the raw JSON string if needed
-                                         headers={'Content-Type': 'application/json'})
-                response.raise_for_status()
-                logging.info(f"Successfully sent temperature for sensor {self.did}: {payload}")
-            except requests.RequestException as e:
-                logging.error(f"Error sending temperature data for sensor {self.did}: {e}")
-
-            time.sleep(common.TEMPERATURE_SENSOR_CLIENT_SLEEP_TIME)
-
+            with self.buffer_changed:
+                if len(self.buffer) < common.TEMPERATURE_SENSOR_BATCH_SIZE:
+                    self.buffer_changed.wait(common.TEMPERATURE_SENSOR_FLUSH_INTERVAL)
+            if not self.flush():
+                time.sleep(common.TEMPERATURE_SENSOR_CLIENT_SLEEP_TIME)
 
         # TODO: END
 
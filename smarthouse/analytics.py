@@ -0,0 +1,200 @@
+"""
+Vectorized analysis of measurement series with NumPy.
+
+A device or room history is loaded once (through `SmartHouseRepository.get_sensor_series`)
+into NumPy arrays of epoch seconds and values, and the operations below work on whole
+arrays instead of issuing a query per question: resampling into fixed buckets, rolling
+means, per-hour threshold counts, percentiles and z-score anomalies.
+
+Timestamps are epoch seconds in UTC, like the stored timestamps are read.
+
+`avg_temperatures_in_room` and `hours_with_humidity_above` answer the same questions as the
+statistics methods of `SmartHouseRepository`. The repository keeps its SQL versions, which
+read the pre-aggregated rollup tables instead of raw readings and are faster for these two
+questions (see `benchmarks/analytics.py`).
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from smarthouse.domain import MeasurementSeries, Room, epoch_to_timestamp
+from smarthouse.persistence import SmartHouseRepository, day_range
+
+DAY = 86400.0
+HOUR = 3600.0
+
+
+class Series:
+    """
+    The readings of one or more devices as NumPy arrays sorted by time. `devices` holds
+    the index (into `device_ids`) of the device each reading comes from.
+    """
+
+    def __init__(self, timestamps: np.ndarray, values: np.ndarray, unit: str,
+                 devices: Optional[np.ndarray] = None, device_ids: Sequence[str] = ()):
+        self.timestamps = timestamps
+        self.values = values
+        self.unit = unit
+        self.devices = devices if devices is not None else np.zeros(len(values), dtype=np.intp)
+        self.device_ids = list(device_ids)
+
+    @classmethod
+    def from_measurement_series(cls, series: MeasurementSeries) -> "Series":
+        # Arrayene deles uten kopiering
+        return cls(np.frombuffer(series.timestamps, dtype=np.float64),
+                   np.frombuffer(series.values, dtype=np.float64),
+                   series.unit, device_ids=[series.device])
+
+    @classmethod
+    def merge(cls, parts: Iterable["Series"], unit: str) -> "Series":
+        """
+        Merges the series of several devices into one, sorted by time.
+        """
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls(np.empty(0), np.empty(0), unit)
+        device_ids = [p.device_ids[0] for p in parts]
+        timestamps = np.concatenate([p.timestamps for p in parts])
+        order = np.argsort(timestamps, kind="stable")
+        return cls(timestamps[order],
+                   np.concatenate([p.values for p in parts])[order],
+                   unit,
+                   np.concatenate([np.full(len(p), i, dtype=np.intp) for i, p in enumerate(parts)])[order],
+                   device_ids)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def for_device(self, device_id: str) -> "Series":
+        index = self.device_ids.index(device_id)
+        mask = self.devices == index
+        return Series(self.timestamps[mask], self.values[mask], self.unit, device_ids=[device_id])
+
+
+def load_device(repo: SmartHouseRepository, device_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                unit: Optional[str] = None) -> Series:
+    """
+    Loads the readings of one device with `start <= ts < end`.
+    """
+    return Series.from_measurement_series(repo.get_sensor_series(device_id, start, end, unit))
+
+
+def load_room(repo: SmartHouseRepository, room: Room, unit: str, start: Optional[str] = None, end: Optional[str] = None) -> Series:
+    """
+    Loads the readings in the given unit from all devices in the room with `start <= ts < end`.
+    """
+    return Series.merge((load_device(repo, device.id, start, end, unit) for device in room.devices), unit)
+
+
+def resample(series: Series, interval: float, how: str = "mean"):
+    """
+    Groups the readings into buckets of `interval` seconds and reduces each bucket with
+    `how` ("mean", "sum", "min", "max" or "count"). Returns the start of each non-empty
+    bucket and the reduced values.
+    """
+    if not len(series):
+        return np.empty(0), np.empty(0)
+    buckets = np.floor(series.timestamps / interval) * interval
+    # Seriene er sortert, så hver bøtte er et sammenhengende stykke
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+    if how == "count":
+        reduced = counts.astype(np.float64)
+    elif how == "sum":
+        reduced = np.add.reduceat(series.values, starts)
+    elif how == "mean":
+        reduced = np.add.reduceat(series.values, starts) / counts
+    elif how == "min":
+        reduced = np.minimum.reduceat(series.values, starts)
+    elif how == "max":
+        reduced = np.maximum.reduceat(series.values, starts)
+    else:
+        raise ValueError(f"Unknown aggregation: {how}")
+    return buckets[starts], reduced
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    The mean of each run of `window` consecutive values (`len(values) - window + 1` results).
+    """
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    if len(values) < window:
+        return np.empty(0)
+    sums = np.cumsum(np.r_[0.0, values])
+    return (sums[window:] - sums[:-window]) / window
+
+
+def hour_of_day(timestamps: np.ndarray) -> np.ndarray:
+    return ((timestamps % DAY) // HOUR).astype(np.intp)
+
+
+def threshold_counts_per_hour(series: Series, threshold: Union[float, np.ndarray]) -> np.ndarray:
+    """
+    Counts, per hour of day (0-23), the readings above `threshold`, which is either a
+    single value or one value per reading.
+    """
+    above = series.values > threshold
+    return np.bincount(hour_of_day(series.timestamps[above]), minlength=24)
+
+
+def percentiles(series: Series, q: Union[float, Sequence[float]]) -> np.ndarray:
+    """
+    The given percentiles (0-100) of the values.
+    """
+    return np.percentile(series.values, q)
+
+
+def zscores(values: np.ndarray) -> np.ndarray:
+    """
+    The distance of each value from the mean, in standard deviations.
+    """
+    std = values.std()
+    if not std:
+        return np.zeros(len(values))
+    return (values - values.mean()) / std
+
+
+def anomalies(series: Series, limit: float = 3.0) -> np.ndarray:
+    """
+    The indices of the readings whose z-score exceeds `limit` in absolute value.
+    """
+    return np.flatnonzero(np.abs(zscores(series.values)) > limit)
+
+
+def daily_means(series: Series) -> Dict[str, float]:
+    """
+    The mean value per day, keyed by the date in ISO format.
+    """
+    days, means = resample(series, DAY)
+    return {epoch_to_timestamp(day)[:10]: float(mean) for day, mean in zip(days, means)}
+
+
+def hours_above_device_average(series: Series, min_count: int = 3) -> List[int]:
+    """
+    The hours of day in which more than `min_count` readings were above the average of
+    the device they came from.
+    """
+    if not len(series):
+        return []
+    sums = np.bincount(series.devices, weights=series.values, minlength=len(series.device_ids))
+    counts = np.bincount(series.devices, minlength=len(series.device_ids))
+    averages = sums / np.maximum(counts, 1)
+    per_hour = threshold_counts_per_hour(series, averages[series.devices])
+    return [int(hour) for hour in np.flatnonzero(per_hour > min_count)]
+
+
+def avg_temperatures_in_room(repo: SmartHouseRepository, room: Room, from_date: Optional[str] = None, until_date: Optional[str] = None) -> Dict[str, float]:
+    """
+    `SmartHouseRepository.calc_avg_temperatures_in_room` computed from the raw readings.
+    """
+    start, end = day_range(from_date, until_date)
+    return daily_means(load_room(repo, room, "°C", start, end))
+
+
+def hours_with_humidity_above(repo: SmartHouseRepository, room: Room, date: str) -> List[int]:
+    """
+    `SmartHouseRepository.calc_hours_with_humidity_above` computed from the raw readings.
+    """
+    start, end = day_range(date, date)
+    return hours_above_device_average(load_room(repo, room, "%", start, end))
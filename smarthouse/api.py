@@ -1,28 +1,78 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException, Path
+from contextlib import asynccontextmanager
+import csv
+import io
+import json
+import asyncio
+import os
+from fastapi import FastAPI, Header, HTTPException, Path, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
-from smarthouse.persistence import SmartHouseRepository
+from fastapi.responses import RedirectResponse, StreamingResponse
+from smarthouse.persistence import (SmartHouseRepository, AsyncSmartHouseRepository, MeasurementWriter, ActuatorStateWriter,
+                                    RollupBackfiller, parse_measurement_cursor)
+from smarthouse.retention import RetentionEngine, RetentionPolicy
+from smarthouse.events import EventBus
+from smarthouse.serialization import dumps, device_dict, encode_measurements, encode_measurement_rows
 from pathlib import Path
-from typing import List, Union, Optional, Dict
+from typing import List, Union, Optional, Dict, Literal
 from smarthouse.models import DeviceModel, SensorModel, ActuatorModel, MeasurementModel, ActuatorStateUpdateRequest
-from smarthouse.domain import Sensor, Actuator
-from uuid import UUID
-from datetime import datetime
+from smarthouse.domain import SmartHouse, Sensor, Actuator
+from uuid import UUID, uuid4
+from datetime import date, datetime
 from random import uniform
 
 def setup_database():
     project_dir = Path(__file__).parent.parent
-    db_file = project_dir / "data" / "db.sql"
+    # SMARTHOUSE_DB kan peke på en annen database, f.eks. for lasttester
+    db_file = Path(os.environ.get("SMARTHOUSE_DB", project_dir / "data" / "db.sql"))
     print(db_file.absolute())
     return SmartHouseRepository(db_file.absolute())
 
-app = FastAPI()
-
 repo = setup_database()
 
+# Endepunktene venter på databasekall som kjøres i egne tråder, slik at event-loopen aldri blokkeres
+async_repo = AsyncSmartHouseRepository(repo)
+
 smarthouse = repo.load_smarthouse_deep()
 
+repo.warm_latest_readings()
+
+# Skriver målinger fra batch-endepunktet i bakgrunnen med gruppevis commit
+measurement_writer = MeasurementWriter(repo)
+
+# Sender endringer videre til klienter som lytter via WebSocket/SSE
+events = EventBus()
+
+# Aktuatortilstanden lever i smarthouse-objektet; databasen oppdateres i bakgrunnen
+state_writer = ActuatorStateWriter(repo)
+
+# Fyller time- og døgnaggregatene fra eksisterende målinger etter en migrering, uten å holde igjen oppstarten
+rollup_backfiller = RollupBackfiller(repo)
+
+# Sletting av gamle målinger per enhetstype, f.eks.
+# {"Temperature Sensor": RetentionPolicy(raw_days=7, hourly_days=365)}.
+# Tom som standard, siden demo-databasen bare inneholder historiske data.
+RETENTION_POLICIES: Dict[str, RetentionPolicy] = {}
+retention = RetentionEngine(repo, RETENTION_POLICIES)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Trådpoolene lages på nytt for hver lifespan, siden de stenges ved nedstengingen
+    async_repo.start()
+    measurement_writer.start()
+    state_writer.start()
+    rollup_backfiller.start()
+    if RETENTION_POLICIES:
+        retention.start()
+    yield
+    retention.stop()
+    rollup_backfiller.stop()
+    state_writer.stop()
+    measurement_writer.stop()
+    async_repo.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
 app.mount("/Users/kingston/ing301public/ing301gruppeA2", StaticFiles(directory=None), name="static")
 
 
@@ -46,9 +96,9 @@ def get_smarthouse_info() -> dict[str, Union[int, float]]:
     about the general structure of the smarthouse.
     """
     return {
-        "no_rooms": len(smarthouse.get_rooms()),
+        "no_rooms": smarthouse.get_no_rooms(),
         "no_floors": len(smarthouse.get_floors()),
-        "registered_devices": len(smarthouse.get_devices()),
+        "registered_devices": smarthouse.get_no_devices(),
         "area": smarthouse.get_area()
     }
 
@@ -57,128 +107,166 @@ def get_smarthouse_info() -> dict[str, Union[int, float]]:
 # here ...
 
 
+class ResponseCache:
+    """
+    Pre-serialized JSON bodies of the structural endpoints, valid for one version of the house.
+    The version also serves as ETag, so polling clients can be answered with 304 Not Modified.
+    """
+
+    def __init__(self, house: SmartHouse):
+        self.house = house
+        # Skiller ETag-er fra ulike serverprosesser, siden versjonen starter på nytt ved oppstart
+        self.instance = uuid4().hex[:8]
+        self.version = house.version
+        self.bodies: Dict[str, bytes] = {}
+
+    def etag(self, version: int) -> str:
+        return f'"{self.instance}-{version}"'
+
+    def respond(self, key: str, build, if_none_match: Optional[str]) -> Response:
+        version = self.house.version
+        if version != self.version:
+            self.bodies = {}
+            self.version = version
+        etag = self.etag(version)
+        headers = {"ETag": etag}
+        if if_none_match is not None and not_modified(etag, if_none_match):
+            return Response(status_code=304, headers=headers)
+        body = self.bodies.get(key)
+        if body is None:
+            body = dumps(build())
+            # Huset kan ha endret seg mens svaret ble bygget; da lagres det ikke
+            if self.house.version == version:
+                self.bodies[key] = body
+        return Response(content=body, media_type="application/json", headers=headers)
+
+def not_modified(etag: str, if_none_match: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+responses = ResponseCache(smarthouse)
+
+
 @app.get("/smarthouse/floor")
-def get_all_floors_info() -> List[Dict]:
+def get_all_floors_info(if_none_match: Optional[str] = Header(default=None)) -> List[Dict]:
     """
     This endpoint returns a list of dictionaries, each providing information about a floor.
     """
-    floors_info = []
-    for floor in smarthouse.get_floors():
-        floor_rooms = floor.rooms
-        floor_area = sum(room.room_size for room in floor_rooms)
-        floor_devices = sum(len(room.devices) for room in floor_rooms)
-        
-        floors_info.append({
-            "floor_level": floor.level,
-            "no_rooms": len(floor_rooms),
-            "total_area": floor_area,
-            "registered_devices": floor_devices
-        })
-
-    return floors_info
+    def build():
+        floors_info = []
+        for floor in smarthouse.get_floors():
+            floors_info.append({
+                "floor_level": floor.level,
+                "no_rooms": len(floor.rooms),
+                "total_area": floor.area,
+                "registered_devices": floor.no_devices
+            })
+        return floors_info
+
+    return responses.respond("floor", build, if_none_match)
 
 @app.get("/smarthouse/floor/{fid}")
 def get_floor_info(fid: int):
     """
     This endpoint returns information about a specific floor
     """
-    floor = next((fl for fl in smarthouse.get_floors() if fl.level == fid), None)
+    floor = smarthouse.get_floor(fid)
     if floor is None:
         raise HTTPException(status_code=404, detail=f"Floor with id {fid} not found")
     
-    total_area = sum(room.room_size for room in floor.rooms)
-    room_count = len(floor.rooms)
-    
     return {
         "level": floor.level,
-        "total_area": total_area,
-        "room_count": room_count
+        "total_area": floor.area,
+        "room_count": len(floor.rooms)
     }
 
 @app.get("/smarthouse/floor/{fid}/room")
-def get_rooms_on_floor(fid: int):
+def get_rooms_on_floor(fid: int, if_none_match: Optional[str] = Header(default=None)):
     """
     This endpoint returns information about the rooms on a specific floor
     """
-    floor = next((f for f in smarthouse.get_floors() if f.level == fid), None)
+    floor = smarthouse.get_floor(fid)
     if not floor:
         raise HTTPException(status_code=404, detail="Floor not found")
 
-    rooms_info = [{
-        "room_name": room.room_name,
-        "room_size": room.room_size,
-        "devices": [{
-            "device_type": device.device_type,
-        } for device in room.devices]
-    } for room in floor.rooms]
+    def build():
+        return [{
+            "room_name": room.room_name,
+            "room_size": room.room_size,
+            "devices": [{
+                "device_type": device.device_type,
+            } for device in room.devices]
+        } for room in floor.rooms]
 
-    return rooms_info
+    return responses.respond(f"floor/{fid}/room", build, if_none_match)
 
 @app.get("/smarthouse/floor/{fid}/room/{rid}")
-def get_room_info(fid: int, rid: str):
+def get_room_info(fid: int, rid: str, if_none_match: Optional[str] = Header(default=None)):
     """
     Fetches information for a specified room on a specified floor, 
     including a summary of each device in that room.
     """
     # Find the specified floor
-    floor = next((f for f in smarthouse.get_floors() if f.level == fid), None)
+    floor = smarthouse.get_floor(fid)
     if not floor:
         raise HTTPException(status_code=404, detail=f"Floor {fid} not found")
 
     # Find the specified room by name on the floor
-    room = next((r for r in floor.rooms if r.room_name == rid), None)
+    room = smarthouse.get_room(floor, rid)
     if not room:
         raise HTTPException(status_code=404, detail=f"Room {rid} not found on floor {fid}")
 
-    # Prepare a summary of each device in the room
-    devices_summary = [{
-        "id": device.id,
-        "model_name": device.model_name,
-        "device_type": device.device_type
-    } for device in room.devices]
-
-    # Construct and return the room information including device summaries
-    room_info = {
-        "room_name": room.room_name,
-        "room_size": room.room_size,
-        "devices": devices_summary
-    }
+    def build():
+        # Prepare a summary of each device in the room
+        devices_summary = [{
+            "id": device.id,
+            "model_name": device.model_name,
+            "device_type": device.device_type
+        } for device in room.devices]
+
+        # Construct and return the room information including device summaries
+        return {
+            "room_name": room.room_name,
+            "room_size": room.room_size,
+            "devices": devices_summary
+        }
+
+    return responses.respond(f"floor/{fid}/room/{rid}", build, if_none_match)
+
+def iso_date(day: Optional[date]) -> Optional[str]:
+    return day.isoformat() if day else None
+
+@app.get("/smarthouse/floor/{fid}/stats/temperature")
+async def get_floor_temperature_stats(fid: int, from_date: Optional[date] = None, until_date: Optional[date] = None):
+    """
+    Daily average temperatures of every room on the floor, computed by one grouped query.
+    `from_date`/`until_date` are inclusive ISO dates; either may be left out.
+    """
+    floor = smarthouse.get_floor(fid)
+    if not floor:
+        raise HTTPException(status_code=404, detail=f"Floor {fid} not found")
+    averages = await async_repo.calc_avg_temperatures_in_rooms(floor, iso_date(from_date), iso_date(until_date))
+    return [{"room_name": room.room_name, "averages": averages[room]} for room in floor.rooms]
 
-    return room_info
+@app.get("/smarthouse/stats/temperature")
+async def get_house_temperature_stats(from_date: Optional[date] = None, until_date: Optional[date] = None):
+    """
+    Daily average temperatures of every room in the house, computed by one grouped query.
+    """
+    averages = await async_repo.calc_avg_temperatures_in_rooms(smarthouse, iso_date(from_date), iso_date(until_date))
+    return [{"floor_level": room.floor.level, "room_name": room.room_name, "averages": averages[room]}
+            for room in smarthouse.get_rooms()]
 
 @app.get("/smarthouse/device", response_model=List[DeviceModel])
-def get_all_devices():
+def get_all_devices(if_none_match: Optional[str] = Header(default=None)):
     '''
     Provides information on all available devices
     '''
-    devices = smarthouse.get_devices()  # Assuming this retrieves all devices correctly
-    response = []
-    for device in devices:
-        # Now build your response based on the type of device
-        if isinstance(device, Sensor):
-            response.append(SensorModel(
-                id=device.id,
-                kind=device.device_type,
-                supplier=device.supplier,
-                product=device.model_name,
-                unit=device.unit
-            ))
-        elif isinstance(device, Actuator):
-            response.append(ActuatorModel(
-                id=device.id,
-                kind=device.device_type,
-                supplier=device.supplier,
-                product=device.model_name,
-                state=device.state
-            ))
-        else:
-            response.append(DeviceModel(
-                id=device.id,
-                kind=device.device_type,
-                supplier=device.supplier,
-                product=device.model_name
-            ))
-    return response
+    def build():
+        # Bygger ordbøkene direkte i stedet for en pydantic-modell per enhet
+        return [device_dict(device) for device in smarthouse.get_devices()]
+
+    return responses.respond("device", build, if_none_match)
 
 # Define a mapping from device kinds to units
 SENSOR_UNITS = {
@@ -221,10 +309,17 @@ def get_device_by_uuid(uuid: str):
         # If the device is neither a sensor nor an actuator, raise a 404 error
         raise HTTPException(status_code=404, detail="Device type not supported")
 
+@app.get("/smarthouse/cache")
+def get_cache_stats():
+    """
+    Hit/miss counters of the in-memory latest-reading cache
+    """
+    return {"latest_readings": repo.latest.stats()}
+
 @app.get("/smarthouse/sensor/{uuid}/current", response_model=MeasurementModel)
-def get_current_sensor_measurement(uuid: str):
+async def get_current_sensor_measurement(uuid: str):
     # Fetch the latest sensor measurement using the provided UUID
-    measurement = repo.get_latest_reading(sensor=uuid)
+    measurement = await async_repo.get_latest_reading(sensor=uuid)
     if not measurement:
         raise HTTPException(status_code=404, detail="No measurement found for this sensor")
 
@@ -237,11 +332,11 @@ def get_current_sensor_measurement(uuid: str):
     )
 
 @app.post("/smarthouse/sensor/{uuid}/current", response_model=MeasurementModel)
-def add_measurement_for_sensor(uuid: UUID):
+async def add_measurement_for_sensor(uuid: UUID):
     """
     Updating sensor measurements
     """
-    sensor = repo.get_sensor_by_id(str(uuid))
+    sensor = await async_repo.get_sensor_by_id(str(uuid))
     
     if not sensor:
         raise HTTPException(status_code=404, detail="Sensor not found")
@@ -259,7 +354,11 @@ def add_measurement_for_sensor(uuid: UUID):
 
     # Add the new measurement to the database using the repository
     try:
-        repo.add_measurement(sensor_id=str(uuid), ts=new_measurement.timestamp.strftime('%Y-%m-%d %H:%M:%S'), value=round(new_measurement.value, 2), unit=new_measurement.unit)
+        ts = new_measurement.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        await async_repo.add_measurement(sensor_id=str(uuid), ts=ts, value=round(new_measurement.value, 2), unit=new_measurement.unit)
+        device = smarthouse.get_device_by_id(str(uuid))
+        if device:
+            events.publish_measurement(device, ts, round(new_measurement.value, 2), new_measurement.unit)
         return new_measurement
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -285,40 +384,107 @@ def generate_random_value_for_sensor_type(device_type: str) -> tuple[float, str]
     correct_unit = SENSOR_UNITS.get(device_type, "%")
     return value, correct_unit
 
+@app.post("/smarthouse/sensor/measurements:batch")
+async def add_measurements_batch(measurements: List[MeasurementModel], deferred: bool = False):
+    """
+    Stores many sensor measurements at once. With `deferred=true` the measurements
+    are queued for the background writer and the request returns immediately.
+    """
+    devices = {str(m.device): smarthouse.get_device_by_id(str(m.device)) for m in measurements}
+    unknown = {device_id for device_id, device in devices.items() if device is None}
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown sensors: {', '.join(sorted(unknown))}")
+    not_sensors = {device_id for device_id, device in devices.items() if not isinstance(device, Sensor)}
+    if not_sensors:
+        raise HTTPException(status_code=422, detail=f"Not sensors: {', '.join(sorted(not_sensors))}")
+
+    rows = [(str(m.device), m.timestamp.strftime('%Y-%m-%d %H:%M:%S'), m.value, m.unit) for m in measurements]
+    if deferred:
+        measurement_writer.submit_many(rows)
+        result = {"queued": len(rows)}
+    else:
+        try:
+            result = {"inserted": await async_repo.add_measurements(rows)}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    for device_id, ts, value, unit in rows:
+        events.publish_measurement(devices[device_id], ts, value, unit)
+    return result
+
 @app.get("/smarthouse/sensor/{uuid}/values", response_model=List[MeasurementModel])
-def get_latest_sensor_values(uuid: UUID, limit: Optional[int] = None):
+async def get_latest_sensor_values(uuid: UUID, limit: Optional[int] = None,
+                                   before: Optional[str] = None, after: Optional[str] = None,
+                                   format: Literal["json", "ndjson", "csv"] = "json"):
     """
-    Returns the desired amount of measurement reading
+    Returns the desired amount of measurement reading, newest first.
+    `before`/`after` are exclusive bounds for keyset pagination: when a page is full, the
+    `X-Next-Before` header holds an opaque cursor to pass as `before` for the next page
+    (a plain timestamp is accepted as well). With `format=ndjson` or `format=csv` the
+    readings are streamed from the database page by page.
     """
+    if before is not None:
+        try:
+            parse_measurement_cursor(before)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    if format != "json":
+        chunks = async_repo.iter_sensor_measurement_chunks(str(uuid), limit, before, after)
+        if format == "ndjson":
+            return StreamingResponse(ndjson_lines(str(uuid), chunks), media_type="application/x-ndjson")
+        return StreamingResponse(csv_lines(str(uuid), chunks), media_type="text/csv")
     try:
-        sensor_measurements = repo.get_latest_sensor_measurements(sensor_id=str(uuid), limit=limit)
-        
-        return [MeasurementModel(device=uuid, timestamp=m.timestamp, value=m.value, unit=m.unit) for m in sensor_measurements]
+        sensor_measurements, next_before = await async_repo.get_sensor_measurements_page(
+            sensor_id=str(uuid), limit=limit, before=before, after=after)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch sensor measurements: {str(e)}")
+    headers = {"X-Next-Before": next_before} if next_before else {}
+    # Svaret kodes direkte; response_model beholdes for OpenAPI-beskrivelsen
+    return Response(content=encode_measurements(str(uuid), sensor_measurements),
+                    media_type="application/json", headers=headers)
+
+async def ndjson_lines(device: str, chunks):
+    # Hver side fra databasen kodes og sendes som én bit
+    async for chunk in chunks:
+        yield encode_measurement_rows(device, chunk)
+
+async def csv_lines(device: str, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["device", "timestamp", "value", "unit"])
+    async for chunk in chunks:
+        for ts, value, unit in chunk:
+            writer.writerow([device, ts, value, unit])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
 
 @app.delete("/smarthouse/sensor/{uuid}/oldest")
-def delete_oldest_measurement(uuid: UUID):
+async def delete_oldest_measurement(uuid: UUID):
     """
     Return the oldest measurement reading
     """
     try:
-        result = repo.delete_oldest_measurement_for_sensor(sensor_id=str(uuid))
-        if result:
-            return {"message": "Oldest measurement deleted successfully."}
-        else:
-            raise HTTPException(status_code=404, detail="No measurements found for this sensor.")
+        result = await async_repo.delete_oldest_measurement_for_sensor(sensor_id=str(uuid))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+    if result:
+        return {"message": "Oldest measurement deleted successfully."}
+    else:
+        raise HTTPException(status_code=404, detail="No measurements found for this sensor.")
+
+def get_actuator(uuid: UUID) -> Actuator:
+    actuator = smarthouse.get_device_by_id(str(uuid))
+    if not isinstance(actuator, Actuator):
+        raise HTTPException(status_code=404, detail="Actuator not found")
+    return actuator
 
 @app.get("/smarthouse/actuator/{uuid}/current", response_model=ActuatorModel)
 def get_current_actuator_state(uuid: UUID):
     """
     Returns the current actuator state
     """
-    actuator = repo.get_actuator_state_by_id(str(uuid))
-    if not actuator:
-        raise HTTPException(status_code=404, detail="Actuator not found")
+    actuator = get_actuator(uuid)
     return ActuatorModel(
         id=str(uuid),
         kind=actuator.device_type,
@@ -333,11 +499,12 @@ async def update_actuator_state(uuid: UUID, state_update: ActuatorStateUpdateReq
     False = 0 = Off
     True = 1 = On
     """
-    actuator = repo.get_actuator_state_by_id(str(uuid))
-    if not actuator:
-        raise HTTPException(status_code=404, detail="Actuator not found")
+    actuator = get_actuator(uuid)
     actuator.state = state_update.state
-    repo.update_actuator_state(actuator)
+    smarthouse.mark_changed()
+    # Lagres av state_writer; flere raske endringer slås sammen til én skriving
+    state_writer.submit(actuator)
+    events.publish_actuator_state(actuator)
     return ActuatorModel(
         id=str(uuid),
         kind=actuator.device_type,
@@ -346,5 +513,60 @@ async def update_actuator_state(uuid: UUID, state_update: ActuatorStateUpdateReq
         state=actuator.state
     )
 
+
+@app.get("/smarthouse/events")
+async def stream_events(device: List[str] = Query(default=[]), room: List[str] = Query(default=[])):
+    """
+    Server-Sent Events stream of actuator state changes and new measurements,
+    optionally limited to the given device ids and/or room names.
+    """
+    subscription = events.subscribe(device, room)
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Kommentar som holder forbindelsen åpen gjennom proxyer
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            events.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.websocket("/smarthouse/ws")
+async def websocket_events(websocket: WebSocket, device: List[str] = Query(default=[]), room: List[str] = Query(default=[])):
+    """
+    WebSocket variant of `/smarthouse/events`; every event is sent as a JSON message.
+    """
+    await websocket.accept()
+    subscription = events.subscribe(device, room)
+    # Klienten sender ingenting, men det må leses fra forbindelsen for å merke at den lukkes
+    # også når det ikke kommer hendelser
+    receiver = asyncio.ensure_future(websocket.receive())
+    getter = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                receiver = asyncio.ensure_future(websocket.receive())
+            if getter in done:
+                await websocket.send_json(getter.result())
+                getter = asyncio.ensure_future(subscription.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        getter.cancel()
+        events.unsubscribe(subscription)
+
+
 if __name__ == '__main__':
     uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -1,18 +1,66 @@
-from datetime import datetime
+from array import array
+from datetime import datetime, timezone
 from random import random
-from typing import List, Optional, Union 
+from sys import intern
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from abc import abstractmethod
 
 class Measurement:
     """
     This class represents a measurement taken from a sensor.
     """
+    # Uten __dict__ per objekt; det blir mange av dem
+    __slots__ = ("timestamp", "value", "unit")
 
     def __init__(self, timestamp:str , value: float, unit: str) -> None:
         self.timestamp = timestamp
         self.value = value
         self.unit = unit
 
+
+def timestamp_to_epoch(timestamp: str) -> float:
+    """
+    Converts a stored timestamp ("YYYY-MM-DD HH:MM:SS", read as UTC) to epoch seconds.
+    """
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+
+
+def epoch_to_timestamp(epoch: float) -> str:
+    """
+    Converts epoch seconds back to the stored timestamp format.
+    """
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MeasurementSeries:
+    """
+    This class holds many readings of one sensor in columnar form: epoch timestamps
+    and values in two `array('d')`, and a single unit shared by all readings.
+    Indexing and iterating yields `Measurement` objects created on demand.
+    """
+    __slots__ = ("device", "unit", "timestamps", "values")
+
+    def __init__(self, device: str, unit: str = "") -> None:
+        self.device = device
+        # Samme enhetsstreng deles av alle serier med samme enhet
+        self.unit = intern(unit)
+        self.timestamps = array('d')
+        self.values = array('d')
+
+    def append(self, epoch: float, value: float):
+        self.timestamps.append(epoch)
+        self.values.append(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index: int) -> Measurement:
+        return Measurement(epoch_to_timestamp(self.timestamps[index]), self.values[index], self.unit)
+
+    def __iter__(self) -> Iterator[Measurement]:
+        for epoch, value in zip(self.timestamps, self.values):
+            yield Measurement(epoch_to_timestamp(epoch), value, self.unit)
+
 class Device:
 
     def __init__(self, id: str, model_name: str, supplier: str, device_type: str):
@@ -90,6 +138,9 @@ class Floor:
     def __init__(self, level):
         self.level = level
         self.rooms = []
+        # Løpende summer som oppdateres av SmartHouse ved registrering
+        self.area = 0.0
+        self.no_devices = 0
 
 class Room:
 
@@ -98,6 +149,8 @@ class Room:
         self.room_size = room_size
         self.room_name = room_name
         self.devices : List[Device]= []
+        # Primærnøkkelen i databasen, satt når rommet er lastet fra SmartHouseRepository
+        self.id : Optional[int] = None
 
 
 
@@ -113,15 +166,27 @@ class SmartHouse:
 
     def __init__(self) -> None:
         self.floors : List[Floor]= []
+        # Oppslagstabeller som holdes oppdatert ved registrering, slik at oppslag er O(1)
+        self.floors_by_level : Dict[int, Floor] = {}
+        self.rooms_by_name : Dict[Tuple[int, Optional[str]], Room] = {}
+        self.devices_by_id : Dict[str, Device] = {}
+        # Løpende summer slik at oversiktene kan besvares uten å gå gjennom alle rom
+        self.area = 0.0
+        self.no_rooms = 0
+        self.no_devices = 0
+        # Økes ved hver endring, slik at API-et vet når mellomlagrede svar er utdaterte
+        self.version = 0
 
     def register_floor(self, level: int) -> Floor:
         # Sjekker først om etasjen allerede er registrert
-        for floor in self.floors:
-            if floor.level == level:
-                return floor
+        floor = self.floors_by_level.get(level)
+        if floor:
+            return floor
         # Hvis ikke, registrerer en ny etasje
         new_floor = Floor(level)
         self.floors.append(new_floor)
+        self.floors_by_level[level] = new_floor
+        self.version += 1
         return new_floor
 
     def register_room(self, floor: Floor, room_size: float, room_name: Optional[str] = None) -> Room:
@@ -131,8 +196,26 @@ class SmartHouse:
         """
         room = Room(floor, room_size, room_name)
         floor.rooms.append(room)
+        floor.area += room_size
+        self.area += room_size
+        self.no_rooms += 1
+        self.rooms_by_name.setdefault((floor.level, room_name), room)
+        self.version += 1
         return room
 
+    def get_floor(self, level: int) -> Optional[Floor]:
+        """
+        This method retrieves the floor with the given level, if registered.
+        """
+        return self.floors_by_level.get(level)
+
+    def get_room(self, floor: Floor, room_name: Optional[str]) -> Optional[Room]:
+        """
+        This method retrieves the room with the given name on the given floor.
+        If several rooms share the same name, the first registered one is returned.
+        """
+        return self.rooms_by_name.get((floor.level, room_name))
+
     def get_floors(self) -> List[Floor]:
         """
         This method returns the list of registered floors in the house.
@@ -156,10 +239,19 @@ class SmartHouse:
         """
         This methods return the total area size of the house, i.e. the sum of the area sizes of each room in the house.
         """
-        result = 0.0
-        for r in self.get_rooms():
-            result += r.room_size
-        return result
+        return self.area
+
+    def get_no_rooms(self) -> int:
+        """
+        This method returns the number of registered rooms in the house.
+        """
+        return self.no_rooms
+
+    def get_no_devices(self) -> int:
+        """
+        This method returns the number of registered devices in the house.
+        """
+        return self.no_devices
 
     def register_device(self, room: Room, device: Device):
         """
@@ -168,8 +260,21 @@ class SmartHouse:
         old_room = device.room
         if old_room:
             old_room.devices.remove(device)
+            old_room.floor.no_devices -= 1
+        else:
+            self.no_devices += 1
         room.devices.append(device)
+        room.floor.no_devices += 1
         device.room = room
+        self.devices_by_id[device.id] = device
+        self.version += 1
+
+    def mark_changed(self):
+        """
+        This method bumps the version of the house after a change that the house
+        cannot see itself, e.g. a new actuator state.
+        """
+        self.version += 1
 
     def get_devices(self) -> List[Device]:
         """This method retrieves a list of all devices in the house"""
@@ -182,8 +287,5 @@ class SmartHouse:
         """
         This method retrieves a device object via its id.
         """
-        for d in self.get_devices():
-            if d.id == device_id:
-                return d
-        return None
+        return self.devices_by_id.get(device_id)
   
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+In-process publish/subscribe of actuator state changes and new measurements, used by
+the WebSocket and Server-Sent Events endpoints in `smarthouse.api`.
+"""
+import asyncio
+import threading
+from typing import Iterable, Optional, Set
+
+from smarthouse.domain import Actuator, Device
+
+
+class Subscription:
+    """
+    A queue of events for one connected client. Only events for the given devices
+    and/or rooms (by name) are delivered; an empty filter matches everything.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, devices: Iterable[str] = (), rooms: Iterable[str] = (), max_queued: int = 1000):
+        self.loop = loop
+        self.devices : Set[str] = set(devices)
+        self.rooms : Set[str] = set(rooms)
+        self.queue : asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+
+    def matches(self, event: dict) -> bool:
+        if self.devices and event["device"] not in self.devices:
+            return False
+        if self.rooms and event["room"] not in self.rooms:
+            return False
+        return True
+
+    def deliver(self, event: dict):
+        # Trege klienter mister de eldste hendelsene i stedet for å holde igjen alle andre
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class EventBus:
+    """
+    Fans events out to all matching subscriptions. `publish` may be called from any
+    thread; delivery happens on each subscriber's event loop.
+    """
+
+    def __init__(self) -> None:
+        self.subscriptions : Set[Subscription] = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, devices: Iterable[str] = (), rooms: Iterable[str] = ()) -> Subscription:
+        """
+        Must be called from within the event loop that will consume the events.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), devices, rooms)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event: dict):
+        with self.lock:
+            subscriptions = [s for s in self.subscriptions if s.matches(event)]
+        for s in subscriptions:
+            s.loop.call_soon_threadsafe(s.deliver, event)
+
+    def publish_actuator_state(self, actuator: Actuator):
+        self.publish({
+            "type": "actuator",
+            "device": actuator.id,
+            "room": room_name(actuator),
+            "state": actuator.state,
+        })
+
+    def publish_measurement(self, device: Device, ts: str, value: float, unit: str):
+        self.publish({
+            "type": "measurement",
+            "device": device.id,
+            "room": room_name(device),
+            "timestamp": ts,
+            "value": value,
+            "unit": unit,
+        })
+
+
+def room_name(device: Device) -> Optional[str]:
+    return device.room.room_name if device.room else None
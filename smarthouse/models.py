@@ -26,6 +26,9 @@ class MeasurementModel(BaseModel):
 
     @validator('timestamp', pre=True, allow_reuse=True)
     def parse_timestamp(cls, v):
+        # Et eksplisitt null behandles som en manglende verdi
+        if v is None:
+            return datetime.now()
         if isinstance(v, str):
             try:
                 # Handles ISO format with 'Z' as UTC
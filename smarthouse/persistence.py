@@ -1,6 +1,218 @@
+import asyncio
+import json
+import logging
+import queue
 import sqlite3
-from typing import Optional
-from smarthouse.domain import Measurement, SmartHouse, Actuator, Sensor, Room
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import date, timedelta
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from smarthouse.domain import Measurement, MeasurementSeries, SmartHouse, Floor, Actuator, Sensor, Room
+from smarthouse import rollups
+
+# Skjemaendringer som kjøres i rekkefølge når databasen åpnes. Versjonen som er
+# tatt i bruk lagres i `PRAGMA user_version`, så nye steg må alltid legges til sist.
+SCHEMA_MIGRATIONS = [
+    # 1: indekser for de vanligste spørringene mot målinger og enheter
+    """
+    CREATE INDEX IF NOT EXISTS measurements_device_ts ON measurements (device, ts, value, unit);
+    CREATE INDEX IF NOT EXISTS measurements_unit_ts ON measurements (unit, ts);
+    CREATE INDEX IF NOT EXISTS devices_room ON devices (room);
+    """,
+    # 2: time- og døgnaggregater per enhet, og hvor langt retention har slettet rådata. Å fylle
+    # aggregatene fra eksisterende målinger registreres bare her og gjøres i biter etterpå
+    # (`backfill_pending_rollups`), så oppstart ikke blokkeres.
+    rollups.CREATE_TABLES + rollups.CREATE_PENDING + rollups.CREATE_WATERMARKS + rollups.PENDING_ALL,
+]
+
+# Grenser for tidsintervaller uten nedre eller øvre grense. Tidsstempler lagres som
+# ISO-tekst, så alle gyldige verdier sorteres mellom disse.
+TS_MIN = ""
+TS_MAX = "9999-12-31T23:59:59"
+ROWID_MIN = -2 ** 63
+ROWID_MAX = 2 ** 63 - 1
+
+
+def day_range(from_date: Optional[str], until_date: Optional[str]) -> Tuple[str, str]:
+    """
+    Turns an inclusive range of ISO dates (either of which may be empty) into a half-open
+    `[start, end)` range of timestamps that can be compared directly against `measurements.ts`.
+    """
+    start = date.fromisoformat(from_date[:10]).isoformat() if from_date else TS_MIN
+    end = (date.fromisoformat(until_date[:10]) + timedelta(days=1)).isoformat() if until_date else TS_MAX
+    return start, end
+
+
+def measurement_cursor(row: Tuple[str, float, str, int]) -> str:
+    """
+    The pagination cursor for a `(ts, value, unit, rowid)` row: `"<ts>|<rowid>"`.
+    """
+    return f"{row[0]}|{row[3]}"
+
+
+def parse_measurement_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Splits a cursor from `measurement_cursor` into `(ts, rowid)`. A plain timestamp is also
+    accepted and then excludes every reading at that timestamp.
+    """
+    ts, separator, rowid = cursor.rpartition("|")
+    if not separator:
+        return cursor, ROWID_MIN
+    try:
+        return ts, int(rowid)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# Timer der mer enn tre fuktighetsmålinger i et rom ligger over døgnsnittet for sin sensor.
+# Døgnsnittet hentes fra døgnaggregatene, og dagen avgrenses som et halvåpent ts-intervall.
+# Timer med mer enn tre fuktighetsmålinger over enhetens gjennomsnitt for døgnet. Gjennomsnittet
+# (AverageHumidity) leses fra døgnaggregatene, eller fra rådata så lenge de ikke er bygget ennå.
+HUMIDITY_HOURS_TAIL = """
+    SELECT
+        CAST(strftime('%H', m.ts) AS INTEGER) as hour
+    FROM AverageHumidity ah
+    CROSS JOIN measurements m ON m.device = ah.device
+    WHERE m.unit = '%' AND m.ts >= :start AND m.ts < :end
+    AND m.value > ah.avg_humidity
+    GROUP BY hour
+    HAVING COUNT(*) > 3
+"""
+
+HUMIDITY_HOURS_QUERY = """
+    WITH AverageHumidity AS (
+        SELECT a.device, a.total / a.count as avg_humidity
+        FROM devices d
+        CROSS JOIN measurements_daily a ON a.device = d.id
+        WHERE d.room = :room AND a.unit = '%' AND a.bucket = :day
+    )
+""" + HUMIDITY_HOURS_TAIL
+
+HUMIDITY_HOURS_RAW_QUERY = """
+    WITH AverageHumidity AS (
+        SELECT m.device, AVG(m.value) as avg_humidity
+        FROM devices d
+        CROSS JOIN measurements m ON m.device = d.id
+        WHERE d.room = :room AND m.unit = '%' AND m.ts >= :start AND m.ts < :end
+        AND DATE(m.ts) IS NOT NULL
+        GROUP BY m.device
+    )
+""" + HUMIDITY_HOURS_TAIL
+
+
+def encode_actuator_state(state: Union[bool, float]) -> str:
+    """
+    Encodes an actuator state for the `states` table: '1'/'0' for on/off, otherwise the number.
+    """
+    return '1' if state is True else '0' if state is False else str(state)
+
+
+def decode_actuator_state(value: Optional[str]) -> Union[bool, float]:
+    """
+    Decodes a value from the `states` table. Besides the encoding written by
+    `encode_actuator_state`, the older 'True'/'False' spelling is understood.
+    """
+    if value is None or value.lower() in ('0', 'false'):
+        return False
+    if value.lower() in ('1', 'true'):
+        return True
+    try:
+        return float(value)
+    except ValueError:
+        return False
+
+
+class LatestReadingCache:
+    """
+    Write-through cache of the most recent measurement per sensor. Once `warm` has
+    loaded the latest reading of every sensor, sensors that are not in the cache are
+    known to have no readings, so lookups never need the database. Sensors whose
+    readings were deleted are marked stale and looked up again on the next access.
+    """
+
+    def __init__(self) -> None:
+        self.readings : Dict[str, Optional[Measurement]] = {}
+        self.stale : Set[str] = set()
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, sensor_id: str) -> Tuple[bool, Optional[Measurement]]:
+        """
+        Returns `(True, measurement)` if the answer is known from the cache,
+        otherwise `(False, None)`.
+        """
+        with self.lock:
+            if sensor_id in self.readings:
+                self.hits += 1
+                return True, self.readings[sensor_id]
+            if self.complete and sensor_id not in self.stale:
+                self.hits += 1
+                return True, None
+            self.misses += 1
+            return False, None
+
+    def put(self, sensor_id: str, measurement: Optional[Measurement]):
+        """
+        Stores a reading read from the database as the latest one for the sensor.
+        The caller must hold the repository's write lock from the read until here,
+        so that no newer reading can be written (and offered) in between.
+        """
+        with self.lock:
+            self.readings[sensor_id] = measurement
+            self.stale.discard(sensor_id)
+
+    def offer(self, sensor_id: str, measurement: Measurement):
+        """
+        Records a newly written reading, unless a newer one is already cached. A sensor
+        that is not cached is only recorded once the cache is complete; otherwise the
+        database may hold a newer reading than this one.
+        """
+        with self.lock:
+            if sensor_id in self.stale:
+                return
+            if sensor_id not in self.readings and not self.complete:
+                return
+            current = self.readings.get(sensor_id)
+            if current is None or measurement.timestamp >= current.timestamp:
+                self.readings[sensor_id] = measurement
+
+    def invalidate(self, sensor_id: str):
+        with self.lock:
+            self.readings.pop(sensor_id, None)
+            self.stale.add(sensor_id)
+
+    def warm(self, rows: Iterable[Tuple[str, str, float, str]]):
+        """
+        Fills the cache from `(device, ts, value, unit)` rows holding the latest reading per sensor.
+        """
+        with self.lock:
+            self.readings = {device: Measurement(ts, value, unit) for device, ts, value, unit in rows}
+            self.stale = set()
+            self.complete = True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.readings)}
+
+
+class ThreadConnection:
+    """
+    The SQLite connection of one thread, together with the repository generation it was
+    opened in (see `SmartHouseRepository.close`).
+    """
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.generation = generation
+
+    def close(self):
+        self.conn.close()
+
 
 # Definerer en klasse som håndterer lagring oglasting
 # av SmartHouse-objektet i SQLlite-db.
@@ -9,14 +221,76 @@ class SmartHouseRepository:
     Provides the functionality to persist and load a SmartHouse object in a SQLite database.
     """
     # Initialiserer klassen med filbanen til SQlite-DB.
-    def __init__(self, file: str) -> None:
+    def __init__(self, file: str, journal_mode: str = "WAL", synchronous: str = "NORMAL",
+                 cache_size: int = -16000, mmap_size: int = 256 * 1024 * 1024, busy_timeout: float = 5.0) -> None:
+        """
+        Each thread gets its own connection to the database, opened lazily on first use.
+        `journal_mode`, `synchronous`, `cache_size` (pages, or KiB when negative) and
+        `mmap_size` (bytes) are applied as pragmas to every connection.
+        """
         self.file = file # Lagrer filbanen
-        self.conn = sqlite3.connect(file, check_same_thread=False) # Oppretter en forbindelse til db.
+        self.pragmas = {
+            "journal_mode": journal_mode,
+            "synchronous": synchronous,
+            "cache_size": cache_size,
+            "mmap_size": mmap_size,
+        }
+        self.busy_timeout = busy_timeout
+        # Én forbindelse per tråd, slik at lesere i WAL-modus ikke venter på hverandre.
+        # Forbindelsene til tråder som avsluttes lukkes av en finalizer (se `connect`).
+        self.local = threading.local()
+        self.connections : "weakref.WeakSet[ThreadConnection]" = weakref.WeakSet()
+        self.connections_lock = threading.Lock()
+        self.generation = 0
+        # Serialiserer skrivinger fra ulike tråder (f.eks. API og bakgrunnsskriver)
+        self.write_lock = threading.Lock()
+        # Siste måling per sensor; holdes oppdatert av alle skrivinger gjennom repository-et
+        self.latest = LatestReadingCache()
+        self.migrate()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        The connection belonging to the calling thread.
+        """
+        holder = getattr(self.local, "holder", None)
+        if holder is None or holder.generation != self.generation:
+            if holder is not None:
+                # Forbindelsen er fra før `close`; den lukkes her, av tråden som eier den
+                holder.close()
+            holder = self.connect()
+        return holder.conn
+
+    def connect(self) -> "ThreadConnection":
+        conn = sqlite3.connect(self.file, check_same_thread=False, timeout=self.busy_timeout) # Oppretter en forbindelse til db.
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        holder = ThreadConnection(conn, self.generation)
+        # Holderen lever bare i trådens threading.local; når tråden avsluttes frigjøres den og forbindelsen lukkes
+        weakref.finalize(holder, conn.close)
+        with self.connections_lock:
+            self.connections.add(holder)
+        self.local.holder = holder
+        return holder
 
+    def close(self):
+        """
+        Closes the connection of the calling thread. Connections of other threads are
+        not closed under their feet: they are replaced on their next use, or closed
+        when the thread ends.
+        """
+        self.generation += 1
+        holder = getattr(self.local, "holder", None)
+        if holder is not None:
+            holder.close()
+            self.local.holder = None
 
-    # Lukker db-tilkoblingen når objektet blir slettet.
+    # Lukker db-tilkoblingene når objektet blir slettet; da kan ingen tråd lenger bruke dem.
     def __del__(self):
-        self.conn.close()
+        with self.connections_lock:
+            holders = list(self.connections)
+        for holder in holders:
+            holder.close()
 
     def cursor(self) -> sqlite3.Cursor:
         """
@@ -27,11 +301,20 @@ class SmartHouseRepository:
         """
         return self.conn.cursor()
 
-    # Lukker og åpner db-tilkoblingen på nytt for å sikre at vi har en frisk forbindelse.
+    # Lukker og åpner db-tilkoblingene på nytt for å sikre at vi har friske forbindelser.
     def reconnect(self):
-        self.conn.close()
-        self.conn = sqlite3.connect(self.file)
-    
+        self.close()
+        self.migrate()
+
+    def migrate(self):
+        """
+        Brings the database schema up to date by running every migration in
+        `SCHEMA_MIGRATIONS` that has not yet been applied to this database.
+        Each migration runs in its own transaction together with the version bump.
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+            self.conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {number}; COMMIT;")
 
     def load_smarthouse_deep(self):
         """
@@ -43,34 +326,38 @@ class SmartHouseRepository:
         smarthouse = SmartHouse()
         cursor = self.conn.cursor()
 
+        # Henter rom, enheter og tilstander i én spørring. Radene leses rett fra
+        # cursoren, og rom slås opp via id i en ordbok i stedet for i en liste.
+        cursor.execute("""
+            SELECT r.id, r.floor, r.area, r.name,
+                   d.id, d.kind, d.category, d.supplier, d.product,
+                   s.state
+            FROM rooms r
+            LEFT JOIN devices d ON d.room = r.id
+            LEFT JOIN states s ON s.device = d.id
+            ORDER BY r.id, d.rowid
+        """)
+        rooms = {}
+        for room_id, floor_level, area, name, device_id, kind, category, supplier, product, state in cursor:
+            room = rooms.get(room_id)
+            if room is None:
+                floor = smarthouse.register_floor(floor_level)
+                room = smarthouse.register_room(floor, area, name)
+                room.id = room_id
+                rooms[room_id] = room
+            if device_id is None:
+                continue
 
-
-        # Henter informasjon om alle rom og registrerer dem i SmartHouse-objektet
-        cursor.execute("SELECT DISTINCT id, floor, area, name FROM rooms")
-        for room_id, floor_level, area, name in cursor.fetchall():
-            # Nå vil denne linjen sjekke for duplisering internt
-            floor = smarthouse.register_floor(floor_level)
-            room = smarthouse.register_room(floor, area, name)
-
-        # Henter informasjon om alle enheter og registrerer dem i tilsvarende rom i SmartHouse-objektet
-        cursor.execute("SELECT id, room, kind, category, supplier, product FROM devices")
-        for device_id, room_id, kind, category, supplier, product in cursor.fetchall():
-            room = smarthouse.get_rooms()[int(room_id)-1]  # Assuming room_id starts at 1
             if category == "actuator":
                 device = Actuator(device_id, product, supplier, kind)
+                # Oppdaterer tilstanden basert på lagret tilstand i db.
+                device.state = decode_actuator_state(state)
             elif category == "sensor":
                 device = Sensor(device_id, product, supplier, kind)
+            else:
+                continue
             smarthouse.register_device(room, device)
-
-        # Henter og oppdaterer tilstanden for alle aktuatorer basert på lagrede tilstander i db.
-        cursor.execute("SELECT device, state FROM states")
-        for device_id, state in cursor.fetchall():
-            device = smarthouse.get_device_by_id(device_id)
-            if device and isinstance(device, Actuator):
-                if state == 'True':
-                    device.turn_on()
-                else:
-                    device.turn_off()
+        cursor.close()
 
         return smarthouse
     
@@ -82,28 +369,64 @@ class SmartHouseRepository:
         Returns None if the given object has no sensor readings.
         """
         sensor_id = sensor if isinstance(sensor, str) else sensor.id
-        # Utfører en spørring for å finne den siste målingen for den gitte sensoren   
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT ts, value, unit FROM measurements WHERE device = ? ORDER BY ts DESC LIMIT 1", (sensor_id,))
-        row = cursor.fetchone()
-        if row:
-            return Measurement(row[0], row[1], row[2]) 
-        return None
+        found, measurement = self.latest.lookup(sensor_id)
+        if found:
+            return measurement
+        return self.fetch_latest_reading(sensor_id)
+
+    def fetch_latest_reading(self, sensor_id: str) -> Optional[Measurement]:
+        """
+        Reads the most recent reading of the sensor from the database and caches it.
+        """
+        # Skrivelåsen holdes fra lesingen til cachen er oppdatert; ellers kan en måling som
+        # skrives i mellomtiden bli overskrevet av den eldre fra databasen
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT ts, value, unit FROM measurements WHERE device = ? ORDER BY ts DESC LIMIT 1", (sensor_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            measurement = Measurement(row[0], row[1], row[2]) if row else None
+            self.latest.put(sensor_id, measurement)
+        return measurement
+
+    def warm_latest_readings(self):
+        """
+        Loads the latest reading of every sensor into the cache with a single query.
+        """
+        # Som i fetch_latest_reading holdes skrivelåsen til cachen er fylt
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            # SQLite henter de øvrige kolonnene fra raden med høyest ts i hver gruppe
+            cursor.execute("SELECT device, MAX(ts), value, unit FROM measurements GROUP BY device")
+            self.latest.warm(cursor)
+            cursor.close()
         
     # Oppdaterer tilstanden for en gitt aktuator i db.
 
     def update_actuator_state(self, actuator: Actuator):
-        state_value = '1' if actuator.state is True else '0' if actuator.state is False else str(actuator.state)
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO states (device, state) VALUES (?, ?)
-            ON CONFLICT(device) DO UPDATE SET state = excluded.state;
-            """, (actuator.id, state_value))
-        self.conn.commit()
+        self.save_actuator_states([(actuator.id, encode_actuator_state(actuator.state))])
+
+    def save_actuator_states(self, states: Iterable[Tuple[str, str]]):
+        """
+        Stores many encoded `(actuator_id, state)` pairs in a single transaction.
+        """
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.executemany("""
+                    INSERT INTO states (device, state) VALUES (?, ?)
+                    ON CONFLICT(device) DO UPDATE SET state = excluded.state;
+                    """, states)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
 
     def get_actuator_state_by_id(self, actuator_id: str) -> Optional[Actuator]:
-        self.conn.row_factory = sqlite3.Row
         cursor = self.conn.cursor()
+        cursor.row_factory = sqlite3.Row
         cursor.execute("""
             SELECT d.id, d.kind, d.supplier, d.product, a.state
             FROM devices d
@@ -118,13 +441,7 @@ class SmartHouseRepository:
                 supplier=row['supplier'],
                 device_type=row['kind']
             )
-            if row['state'] is not None:
-                try:
-                    actuator.state = float(row['state'])
-                except ValueError:
-                    actuator.state = row['state'].lower() == 'true'
-            else:
-                actuator.state = False
+            actuator.state = decode_actuator_state(row['state'])
             return actuator
         return None
         
@@ -139,43 +456,221 @@ class SmartHouseRepository:
         return None
 
     def add_measurement(self, sensor_id: str, ts: str, value: float, unit: str):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO measurements (device, ts, value, unit) VALUES (?, ?, ?, ?)
-        """, (sensor_id, ts, value, unit))
-        self.conn.commit()
-        cursor.close()
+        self.add_measurements([(sensor_id, ts, value, unit)])
+
+    def add_measurements(self, measurements: Iterable[Tuple[str, str, float, str]]) -> int:
+        """
+        Stores many measurements, given as `(sensor_id, ts, value, unit)` tuples,
+        in a single transaction. Returns the number of stored measurements.
+        """
+        rows = list(measurements)
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.executemany("""
+                    INSERT INTO measurements (device, ts, value, unit) VALUES (?, ?, ?, ?)
+                """, rows)
+                # Aggregatene oppdateres i samme transaksjon som rådataene
+                rollups.add(cursor, rows)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            for sensor_id, ts, value, unit in rows:
+                self.latest.offer(sensor_id, Measurement(ts, value, unit))
+            return len(rows)
     
-    def get_latest_sensor_measurements(self, sensor_id: str, limit: Optional[int] = None) -> list:
+    def get_latest_sensor_measurements(self, sensor_id: str, limit: Optional[int] = None,
+                                       before: Optional[str] = None, after: Optional[str] = None) -> list:
+        """
+        Returns the measurements of the given sensor, newest first. `before` is either a
+        timestamp or a cursor from `get_sensor_measurements_page`, `after` a timestamp;
+        both bounds are exclusive.
+        """
+        return self.get_sensor_measurements_page(sensor_id, limit, before, after)[0]
+
+    def get_sensor_measurements_page(self, sensor_id: str, limit: Optional[int] = None, before: Optional[str] = None,
+                                     after: Optional[str] = None) -> Tuple[List[Measurement], Optional[str]]:
+        """
+        One page of a keyset-paginated listing, newest first. Returns the measurements and,
+        when the page is full, the cursor to pass as `before` to get the next page.
+        """
+        rows = self.fetch_sensor_measurement_rows(sensor_id, limit, before, after)
+        next_before = measurement_cursor(rows[-1]) if limit is not None and rows and len(rows) == limit else None
+        return [Measurement(timestamp=ts, value=value, unit=unit) for ts, value, unit, _ in rows], next_before
+
+    def fetch_sensor_measurement_rows(self, sensor_id: str, limit: Optional[int] = None, before: Optional[str] = None,
+                                      after: Optional[str] = None) -> List[Tuple[str, float, str, int]]:
+        """
+        Returns `(ts, value, unit, rowid)` rows, newest first. Rows are ordered by `(ts, rowid)`,
+        so readings that share a timestamp are neither skipped nor repeated across pages.
+        """
+        before_ts, before_rowid = parse_measurement_cursor(before) if before else (TS_MAX, ROWID_MAX)
         cursor = self.conn.cursor()
-        if limit is not None:
-            cursor.execute("SELECT device, ts, value, unit FROM measurements WHERE device = ? ORDER BY ts DESC LIMIT ?", (sensor_id, limit))
-        else:
-            cursor.execute("SELECT device, ts, value, unit FROM measurements WHERE device = ? ORDER BY ts DESC", (sensor_id,))
-        measurements = cursor.fetchall()
-        # Convert the raw data into Measurement instances or a suitable format for the endpoint
-        return [Measurement(timestamp=m[1], value=m[2], unit=m[3]) for m in measurements]
+        try:
+            # Én fast spørring; manglende grenser erstattes av TS_MIN/TS_MAX og LIMIT -1 (ingen grense).
+            # `ts <= ?` gir et intervallsøk i indeksen, som også inneholder rowid.
+            cursor.execute("""
+                SELECT ts, value, unit, rowid FROM measurements
+                WHERE device = ? AND ts <= ? AND (ts < ? OR rowid < ?) AND ts > ?
+                ORDER BY ts DESC, rowid DESC
+                LIMIT ?
+            """, (sensor_id, before_ts, before_ts, before_rowid, after or TS_MIN, -1 if limit is None else limit))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def iter_sensor_measurements(self, sensor_id: str, limit: Optional[int] = None,
+                                 before: Optional[str] = None, after: Optional[str] = None,
+                                 chunk_size: int = 1000) -> Iterator[Tuple[str, float, str]]:
+        """
+        Yields `(ts, value, unit)` rows like `get_latest_sensor_measurements`, but reads them
+        one keyset page of `chunk_size` rows at a time instead of materializing them all.
+        No cursor is kept open between pages, so the generator may be resumed from any thread.
+        """
+        for chunk in self.iter_sensor_measurement_chunks(sensor_id, limit, before, after, chunk_size):
+            yield from chunk
+
+    def iter_sensor_measurement_chunks(self, sensor_id: str, limit: Optional[int] = None,
+                                       before: Optional[str] = None, after: Optional[str] = None,
+                                       chunk_size: int = 1000) -> Iterator[List[Tuple[str, float, str]]]:
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            rows = self.fetch_sensor_measurement_rows(sensor_id, size, before, after)
+            if rows:
+                yield [(ts, value, unit) for ts, value, unit, _ in rows]
+            if len(rows) < size:
+                break
+            before = measurement_cursor(rows[-1])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def get_sensor_series(self, sensor_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                          unit: Optional[str] = None, chunk_size: int = 10000) -> MeasurementSeries:
+        """
+        Returns the readings of the sensor with `start <= ts < end` as a `MeasurementSeries`,
+        oldest first. This is meant for bulk queries (analytics, export) where one object
+        per reading would be too costly. Without `unit`, the unit of the first reading is
+        used, and a `ValueError` is raised if the readings have different units.
+        """
+        cursor = self.conn.cursor()
+        try:
+            # SQLite regner om til epoke-sekunder, så Python slipper å tolke hver tekststreng;
+            # tidsstempler som ikke kan tolkes, gir NULL og hoppes over
+            cursor.execute("""
+                SELECT CAST(strftime('%s', ts) AS REAL), value, COALESCE(unit, '') FROM measurements
+                WHERE device = ? AND ts >= ? AND ts < ? AND (? IS NULL OR unit = ?)
+                AND strftime('%s', ts) IS NOT NULL
+                ORDER BY ts ASC
+            """, (sensor_id, start or TS_MIN, end or TS_MAX, unit, unit))
+            rows = cursor.fetchmany(chunk_size)
+            series = MeasurementSeries(sensor_id, unit or (rows[0][2] if rows else "") or "")
+            while rows:
+                if any(row[2] != series.unit for row in rows):
+                    raise ValueError(f"Sensor {sensor_id} has readings in more than one unit")
+                series.timestamps.extend([row[0] for row in rows])
+                series.values.extend([row[1] for row in rows])
+                rows = cursor.fetchmany(chunk_size)
+            return series
+        finally:
+            cursor.close()
     
     def delete_oldest_measurement_for_sensor(self, sensor_id: str) -> bool:
-        cursor = self.conn.cursor()
-        # Først, finn ID-en til den eldste målingen for sensoren
-        cursor.execute("""
-            SELECT ts FROM measurements
-            WHERE device = ?
-            ORDER BY ts ASC
-            LIMIT 1
-        """, (sensor_id,))
-        oldest_measurement_ts = cursor.fetchone()
-        if oldest_measurement_ts:
-            # Deretter, slett den eldste målingen
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            # Først, finn ID-en til den eldste målingen for sensoren
             cursor.execute("""
-                DELETE FROM measurements
-                WHERE device = ? AND ts = ?
-            """, (sensor_id, oldest_measurement_ts[0]))
+                SELECT ts FROM measurements
+                WHERE device = ?
+                ORDER BY ts ASC
+                LIMIT 1
+            """, (sensor_id,))
+            oldest_measurement_ts = cursor.fetchone()
+            if oldest_measurement_ts:
+                # Deretter, slett den eldste målingen og beregn berørte aggregater på nytt
+                cursor.execute("""
+                    DELETE FROM measurements
+                    WHERE device = ? AND ts = ?
+                """, (sensor_id, oldest_measurement_ts[0]))
+                rollups.refresh(cursor, sensor_id, oldest_measurement_ts[0])
+                self.conn.commit()
+                self.latest.invalidate(sensor_id)
+                return True
+            return False
+
+    def backfill_rollups(self, from_date: Optional[str] = None, until_date: Optional[str] = None) -> int:
+        """
+        Rebuilds the hourly and daily rollups from the raw measurements in the given
+        (inclusive, possibly unbounded) date range, together with any other pending
+        backfill. Returns the number of device ranges that were rebuilt.
+        """
+        start, end = day_range(from_date, until_date)
+        with self.write_lock:
+            self.conn.execute("INSERT INTO rollups_pending (start, end) VALUES (?, ?)", (start, end))
             self.conn.commit()
-            return True
-        return False
-                           
+        return self.backfill_pending_rollups()
+
+    def backfill_pending_rollups(self, stopped: Optional[threading.Event] = None) -> int:
+        """
+        Works off the backfills recorded in `rollups_pending` one device per transaction,
+        so writers are only held up briefly. Stops early once `stopped` is set; the rest is
+        resumed by the next call. Returns the number of device ranges that were rebuilt.
+        """
+        done = 0
+        while stopped is None or not stopped.is_set():
+            with self.write_lock:
+                cursor = self.conn.cursor()
+                try:
+                    cursor.execute("SELECT rowid, start, end, device FROM rollups_pending ORDER BY rowid LIMIT 1")
+                    job = cursor.fetchone()
+                    if job is None:
+                        break
+                    rowid, start, end, last_device = job
+                    # Neste enhet som har målinger, slått opp i indeksen på (device, ts)
+                    cursor.execute("SELECT device FROM measurements WHERE device > ? ORDER BY device LIMIT 1", (last_device,))
+                    row = cursor.fetchone()
+                    if row is None:
+                        cursor.execute("DELETE FROM rollups_pending WHERE rowid = ?", (rowid,))
+                    else:
+                        rollups.backfill(cursor, start, end, row[0])
+                        cursor.execute("UPDATE rollups_pending SET device = ? WHERE rowid = ?", (row[0], rowid))
+                        done += 1
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        return done
+
+    def rollups_ready(self, start: str, end: str) -> bool:
+        """
+        Whether the rollups cover the measurements with `start <= ts < end`, i.e. no
+        backfill of an overlapping range is still pending. Until then, the statistics
+        below are computed from the raw measurements instead.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM rollups_pending WHERE start < ? AND end > ? LIMIT 1", (end, start))
+        pending = cursor.fetchone() is not None
+        cursor.close()
+        return not pending
+
+    def get_room_id(self, room: Room) -> Optional[int]:
+        """
+        Returns the database id of the given room. Rooms that were not loaded from
+        this database are looked up by their name.
+        """
+        if room.id is not None:
+            return room.id
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id FROM rooms WHERE name = ?", (room.room_name,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
     # statistics
     
     # Beregner gjennomsnittstemperaturen i et gitt rom for en gitt tidsperiode.
@@ -190,32 +685,29 @@ class SmartHouseRepository:
         The result should be a dictionary where the keys are strings representing dates (iso format) and 
         the values are floating point numbers containing the average temperature that day.
         """
+        # Leser døgnaggregatene i stedet for rådata. Bøttene sammenlignes mot et
+        # halvåpent intervall, og rommet slås opp via id. CROSS JOIN låser
+        # rekkefølgen: først rommets enheter, deretter deres aggregater.
+        start, end = day_range(from_date, until_date)
         cursor = self.conn.cursor()
-        
-        # Bygger SQL-spørringen dynamisk basert på inngitte parametere
-        query = """
-        SELECT DATE(m.ts) as date, AVG(m.value) as avg_temp
-        FROM measurements m
-        INNER JOIN devices d ON m.device = d.id
-        INNER JOIN rooms r ON d.room = r.id
-        WHERE r.name = ? AND m.unit = '°C' 
-        """ 
-        # Add conditions for the date range if specified
-        parameters = [room.room_name] # Initialiserer parameterlisten med romnavnet
-        # Legger til datoområdebegrensninger i spørringen hvis spesifisert
-        if from_date and until_date:
-            query += "AND DATE(m.ts) >= ? AND DATE(m.ts) <= ? "
-            parameters.extend([from_date, until_date])
-        elif from_date:
-            query += "AND DATE(m.ts) >= ? "
-            parameters.append(from_date)
-        elif until_date:
-            query += "AND DATE(m.ts) <= ? "
-            parameters.append(until_date)
-        
-        query += "GROUP BY DATE(m.ts)" # Grupperer resultatene etter
-        
-        cursor.execute(query, parameters)
+        if self.rollups_ready(start, end):
+            cursor.execute("""
+                SELECT a.bucket as date, SUM(a.total) / SUM(a.count) as avg_temp
+                FROM devices d
+                CROSS JOIN measurements_daily a ON a.device = d.id
+                WHERE d.room = ? AND a.unit = '°C'
+                AND a.bucket >= ? AND a.bucket < ?
+                GROUP BY a.bucket
+            """, (self.get_room_id(room), start, end))
+        else:
+            cursor.execute("""
+                SELECT DATE(m.ts) as date, AVG(m.value) as avg_temp
+                FROM devices d
+                CROSS JOIN measurements m ON m.device = d.id
+                WHERE d.room = ? AND m.unit = '°C'
+                AND m.ts >= ? AND m.ts < ? AND DATE(m.ts) IS NOT NULL
+                GROUP BY DATE(m.ts)
+            """, (self.get_room_id(room), start, end))
         results = cursor.fetchall()
         cursor.close()
         
@@ -223,6 +715,50 @@ class SmartHouseRepository:
         avg_temperatures = {result[0]: result[1] for result in results}
         
         return avg_temperatures
+
+    def calc_avg_temperatures_in_rooms(self, rooms: Union[Iterable[Room], Floor, SmartHouse],
+                                       from_date: Optional[str] = None, until_date: Optional[str] = None) -> Dict[Room, dict]:
+        """
+        Batch variant of `calc_avg_temperatures_in_room` for a list of rooms, all rooms
+        on a floor or all rooms in the house. The daily averages of every room are
+        computed by one grouped scan; the result maps each room to a dictionary like
+        the one returned for a single room (empty if the room has no readings).
+        """
+        if isinstance(rooms, SmartHouse):
+            rooms = rooms.get_rooms()
+        elif isinstance(rooms, Floor):
+            rooms = rooms.rooms
+        by_id = {}
+        for room in rooms:
+            by_id.setdefault(self.get_room_id(room), []).append(room)
+        results: Dict[Room, dict] = {room: {} for ids in by_id.values() for room in ids}
+        start, end = day_range(from_date, until_date)
+        cursor = self.conn.cursor()
+        # Rom-id-ene sendes som én JSON-liste, slik at SQL-teksten er den samme uansett antall rom
+        room_ids = json.dumps([room_id for room_id in by_id if room_id is not None])
+        if self.rollups_ready(start, end):
+            cursor.execute("""
+                SELECT d.room, a.bucket, SUM(a.total) / SUM(a.count)
+                FROM devices d
+                CROSS JOIN measurements_daily a ON a.device = d.id
+                WHERE d.room IN (SELECT value FROM json_each(?)) AND a.unit = '°C'
+                AND a.bucket >= ? AND a.bucket < ?
+                GROUP BY d.room, a.bucket
+            """, (room_ids, start, end))
+        else:
+            cursor.execute("""
+                SELECT d.room, DATE(m.ts), AVG(m.value)
+                FROM devices d
+                CROSS JOIN measurements m ON m.device = d.id
+                WHERE d.room IN (SELECT value FROM json_each(?)) AND m.unit = '°C'
+                AND m.ts >= ? AND m.ts < ? AND DATE(m.ts) IS NOT NULL
+                GROUP BY d.room, DATE(m.ts)
+            """, (room_ids, start, end))
+        for room_id, day, avg_temp in cursor:
+            for room in by_id[room_id]:
+                results[room][day] = avg_temp
+        cursor.close()
+        return results
     
     def calc_hours_with_humidity_above(self, room: Room, date: str) -> list:
         """
@@ -231,31 +767,281 @@ class SmartHouseRepository:
         the average recorded humidity in that room at that particular time.
         The result is a (possibly empty) list of number representing hours [0-23].
         """
+        # Fast, parametrisert spørring: samme SQL-tekst for alle rom og dager, slik at
+        # sqlite3 kan gjenbruke den forberedte setningen fra sin statement-cache.
+        start, end = day_range(date, date)
         cursor = self.conn.cursor()
-
-        query = f"""
-        WITH AverageHumidity AS ( 
-            SELECT m.device, AVG(m.value) as avg_humidity
-            FROM measurements m
-            INNER JOIN devices d ON m.device = d.id
-            INNER JOIN rooms r ON d.room = r.id
-            WHERE r.name LIKE '{room.room_name}%' AND DATE(m.ts) = ?
-            AND m.unit = '%'
-            GROUP BY m.device
-        )
-        SELECT 
-            CAST(strftime('%H', m.ts) AS INTEGER) as hour
-        FROM measurements m
-        INNER JOIN AverageHumidity ah ON m.device = ah.device
-        WHERE DATE(m.ts) = ? AND m.unit = '%' 
-        AND m.value > ah.avg_humidity
-        GROUP BY hour
-        HAVING COUNT(*) > 3
-        """
-
-        cursor.execute(query, (date, date))
+        query = HUMIDITY_HOURS_QUERY if self.rollups_ready(start, end) else HUMIDITY_HOURS_RAW_QUERY
+        cursor.execute(query, {"room": self.get_room_id(room), "day": start, "start": start, "end": end})
         results = cursor.fetchall()
         cursor.close()
 
         # Return a list of hours where the count of measurements above the average is greater than three
         return [hour[0] for hour in results]
+
+
+
+class MeasurementWriter:
+    """
+    Collects measurements in a queue and writes them to the repository from a
+    background thread. Queued measurements are group-committed either when
+    `max_batch` measurements are waiting or `flush_interval_ms` milliseconds
+    have passed since the first of them arrived, whichever comes first. A batch that
+    fails with a temporary database error (`sqlite3.OperationalError`, e.g. "database is
+    locked") is queued again and retried after `retry_interval_ms` milliseconds.
+    """
+
+    def __init__(self, repo: SmartHouseRepository, flush_interval_ms: int = 50, max_batch: int = 1000,
+                 retry_interval_ms: int = 1000):
+        self.repo = repo
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch = max_batch
+        self.retry_interval_ms = retry_interval_ms
+        self.queue : queue.Queue = queue.Queue()
+        self.thread : Optional[threading.Thread] = None
+        self.running = False
+
+    def submit(self, sensor_id: str, ts: str, value: float, unit: str):
+        self.queue.put((sensor_id, ts, value, unit))
+
+    def submit_many(self, measurements: Iterable[Tuple[str, str, float, str]]):
+        for m in measurements:
+            self.queue.put(m)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="measurement-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread after writing everything that is still queued.
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes everything currently queued in the calling thread.
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return 0
+        try:
+            return self.repo.add_measurements(batch)
+        except sqlite3.OperationalError:
+            self.submit_many(batch)
+            raise
+
+    def run(self):
+        while self.running:
+            # Venter på første måling, og samler deretter opp til max_batch eller tidsfristen
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.repo.add_measurements(batch)
+            except sqlite3.OperationalError:
+                # Midlertidig feil: målingene er allerede bekreftet overfor klienten, så de legges
+                # tilbake i køen og skrives senere
+                logging.exception(f"Failed to write {len(batch)} measurements, retrying")
+                self.submit_many(batch)
+                time.sleep(self.retry_interval_ms / 1000)
+            except Exception:
+                # Tråden må overleve én ugyldig batch; målingene i den logges og forkastes
+                logging.exception(f"Failed to write {len(batch)} measurements, dropping them: {batch[:10]}")
+
+
+class ActuatorStateWriter:
+    """
+    Write-behind persistence of actuator states. Submitted states are coalesced per
+    actuator, so only the latest state of each is written when the queue is flushed
+    by the background thread every `flush_interval_ms` milliseconds.
+    """
+
+    def __init__(self, repo: SmartHouseRepository, flush_interval_ms: int = 200):
+        self.repo = repo
+        self.flush_interval_ms = flush_interval_ms
+        self.pending : Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread : Optional[threading.Thread] = None
+
+    def submit(self, actuator: Actuator):
+        with self.lock:
+            self.pending[actuator.id] = encode_actuator_state(actuator.state)
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="actuator-state-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread after writing the pending states.
+        """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            try:
+                self.repo.save_actuator_states(pending.items())
+            except sqlite3.Error:
+                # Legger tilstandene tilbake, med mindre nyere allerede er sendt inn
+                with self.lock:
+                    self.pending = {**pending, **self.pending}
+                raise
+        return len(pending)
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval_ms / 1000):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logging.exception("Failed to write actuator states")
+
+
+class RollupBackfiller:
+    """
+    Works off the pending rollup backfills of a repository in a background thread,
+    e.g. the initial one recorded by the schema migration.
+    """
+
+    def __init__(self, repo: SmartHouseRepository):
+        self.repo = repo
+        self.stopped = threading.Event()
+        self.thread : Optional[threading.Thread] = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="rollup-backfill", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        try:
+            done = self.repo.backfill_pending_rollups(self.stopped)
+            if done:
+                logging.info(f"Rebuilt rollups for {done} device ranges")
+        except Exception:
+            logging.exception("Rollup backfill failed")
+
+
+class AsyncSmartHouseRepository:
+    """
+    Awaitable facade for a `SmartHouseRepository`, for use from `async` request handlers.
+    The blocking sqlite3 calls run on a dedicated thread pool (each thread with its own
+    connection), and statistics on a separate, smaller pool so that slow reports never
+    occupy the threads serving cheap reads and writes.
+    """
+
+    def __init__(self, repo: SmartHouseRepository, workers: int = 8, statistics_workers: int = 2):
+        self.repo = repo
+        self.workers = workers
+        self.statistics_workers = statistics_workers
+        self.executor : Optional[ThreadPoolExecutor] = None
+        self.statistics_executor : Optional[ThreadPoolExecutor] = None
+        self.start()
+
+    def start(self):
+        """
+        Creates the thread pools, unless they are already running. Called again after
+        `shutdown`, e.g. when an application's lifespan starts a second time.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="db")
+        if self.statistics_executor is None:
+            self.statistics_executor = ThreadPoolExecutor(self.statistics_workers, thread_name_prefix="db-statistics")
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def run_statistics(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.statistics_executor, partial(fn, *args, **kwargs))
+
+    async def get_latest_reading(self, sensor) -> Optional[Measurement]:
+        # Svar fra cachen krever ingen tråd
+        sensor_id = sensor if isinstance(sensor, str) else sensor.id
+        found, measurement = self.repo.latest.lookup(sensor_id)
+        if found:
+            return measurement
+        return await self.run(self.repo.fetch_latest_reading, sensor_id)
+
+    async def get_sensor_by_id(self, sensor_id: str) -> Optional[Sensor]:
+        return await self.run(self.repo.get_sensor_by_id, sensor_id)
+
+    async def add_measurement(self, sensor_id: str, ts: str, value: float, unit: str):
+        return await self.run(self.repo.add_measurement, sensor_id, ts, value, unit)
+
+    async def add_measurements(self, measurements: Iterable[Tuple[str, str, float, str]]) -> int:
+        return await self.run(self.repo.add_measurements, measurements)
+
+    async def get_latest_sensor_measurements(self, sensor_id: str, limit: Optional[int] = None,
+                                             before: Optional[str] = None, after: Optional[str] = None) -> list:
+        return await self.run(self.repo.get_latest_sensor_measurements, sensor_id, limit, before, after)
+
+    async def get_sensor_measurements_page(self, sensor_id: str, limit: Optional[int] = None, before: Optional[str] = None,
+                                           after: Optional[str] = None) -> Tuple[List[Measurement], Optional[str]]:
+        return await self.run(self.repo.get_sensor_measurements_page, sensor_id, limit, before, after)
+
+    async def iter_sensor_measurement_chunks(self, sensor_id: str, limit: Optional[int] = None,
+                                             before: Optional[str] = None, after: Optional[str] = None,
+                                             chunk_size: int = 1000) -> AsyncIterator[List[Tuple[str, float, str]]]:
+        """
+        Async variant of `SmartHouseRepository.iter_sensor_measurement_chunks`; every page is
+        read on the executor.
+        """
+        chunks = self.repo.iter_sensor_measurement_chunks(sensor_id, limit, before, after, chunk_size)
+        while True:
+            chunk = await self.run(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    async def delete_oldest_measurement_for_sensor(self, sensor_id: str) -> bool:
+        return await self.run(self.repo.delete_oldest_measurement_for_sensor, sensor_id)
+
+    async def calc_avg_temperatures_in_room(self, room: Room, from_date: Optional[str] = None, until_date: Optional[str] = None) -> dict:
+        return await self.run_statistics(self.repo.calc_avg_temperatures_in_room, room, from_date, until_date)
+
+    async def calc_avg_temperatures_in_rooms(self, rooms: Union[Iterable[Room], Floor, SmartHouse],
+                                             from_date: Optional[str] = None, until_date: Optional[str] = None) -> Dict[Room, dict]:
+        return await self.run_statistics(self.repo.calc_avg_temperatures_in_rooms, rooms, from_date, until_date)
+
+    async def calc_hours_with_humidity_above(self, room: Room, date: str) -> list:
+        return await self.run_statistics(self.repo.calc_hours_with_humidity_above, room, date)
+
+    def shutdown(self):
+        for executor in (self.executor, self.statistics_executor):
+            if executor is not None:
+                executor.shutdown()
+        self.executor = self.statistics_executor = None
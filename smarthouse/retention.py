@@ -0,0 +1,141 @@
+"""
+Time-series retention: raw measurements, hourly and daily rollups are pruned
+after a configurable number of days per device type. Since the rollups are
+maintained on ingestion, dropping raw rows leaves their hourly/daily averages in
+place, i.e. old data is downsampled rather than lost. How far the raw rows of each
+device have been deleted is recorded as a watermark, so that a later rollup backfill
+does not rebuild the downsampled buckets from what is left of them.
+
+Deletion happens in small chunks, each in its own short transaction, so that
+ingestion is never blocked for long.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from smarthouse import rollups
+from smarthouse.persistence import SmartHouseRepository
+from smarthouse.rollups import ROLLUPS
+
+
+class RetentionPolicy:
+    """
+    How many days of raw measurements and of hourly/daily rollups to keep.
+    `None` means the data is kept forever.
+    """
+
+    def __init__(self, raw_days: Optional[int] = 7, hourly_days: Optional[int] = 365, daily_days: Optional[int] = None):
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+
+
+class RetentionEngine:
+    """
+    Applies retention policies, keyed by device type (`devices.kind`), to the
+    measurements in a repository. Devices whose type has no policy fall back to
+    `default`, or are left alone if there is none.
+    """
+
+    def __init__(self, repo: SmartHouseRepository, policies: Dict[str, RetentionPolicy],
+                 default: Optional[RetentionPolicy] = None, chunk_size: int = 5000,
+                 pause: float = 0.01, interval: float = 60.0):
+        self.repo = repo
+        self.policies = policies
+        self.default = default
+        self.chunk_size = chunk_size
+        # Pause mellom bitene (sekunder) slik at ventende skrivinger slipper til
+        self.pause = pause
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread : Optional[threading.Thread] = None
+
+    def policy_for(self, kind: str) -> Optional[RetentionPolicy]:
+        return self.policies.get(kind, self.default)
+
+    def run_once(self, now: Optional[datetime] = None) -> int:
+        """
+        Deletes everything that has expired according to the policies and
+        returns the number of deleted rows.
+        """
+        now = now or datetime.now()
+        cursor = self.repo.conn.cursor()
+        cursor.execute("SELECT id, kind FROM devices")
+        devices = cursor.fetchall()
+        cursor.close()
+
+        deleted = 0
+        for device_id, kind in devices:
+            policy = self.policy_for(kind)
+            if policy is None:
+                continue
+            if policy.raw_days is not None:
+                cutoff = (now - timedelta(days=policy.raw_days)).strftime('%Y-%m-%d %H:%M:%S')
+                # Vannmerket skrives før første bit slettes: en backfill mellom to biter skal ikke
+                # bygge aggregatene før grensen på nytt fra de delvis slettede rådataene
+                with self.repo.write_lock:
+                    cursor = self.repo.conn.cursor()
+                    cursor.execute("SELECT 1 FROM measurements WHERE device = ? AND ts < ? LIMIT 1", (device_id, cutoff))
+                    if cursor.fetchone():
+                        rollups.record_watermark(cursor, device_id, cutoff)
+                        self.repo.conn.commit()
+                    cursor.close()
+                count = self.delete_before("measurements", "ts", device_id, cutoff)
+                if count:
+                    self.repo.latest.invalidate(device_id)
+                deleted += count
+            for rollup, days in (("hourly", policy.hourly_days), ("daily", policy.daily_days)):
+                if days is None or self.stopped.is_set():
+                    continue
+                # Bare bøtter som slutter før grensen slettes; bøtten grensen ligger i beholdes hel
+                cutoff = rollups.bucket_of(rollup, now - timedelta(days=days))
+                deleted += self.delete_before(ROLLUPS[rollup][0], "bucket", device_id, cutoff)
+            if self.stopped.is_set():
+                return deleted
+        return deleted
+
+    def delete_before(self, table: str, column: str, device_id: str, cutoff: str) -> int:
+        """
+        Deletes the rows of one device older than `cutoff` from the given table,
+        at most `chunk_size` rows per transaction.
+        """
+        deleted = 0
+        while not self.stopped.is_set():
+            # Skrivelåsen holdes bare for én liten bit om gangen
+            with self.repo.write_lock:
+                cursor = self.repo.conn.cursor()
+                cursor.execute(f"""
+                    DELETE FROM {table} WHERE rowid IN (
+                        SELECT rowid FROM {table} WHERE device = ? AND {column} < ? LIMIT ?
+                    )
+                """, (device_id, cutoff, self.chunk_size))
+                count = cursor.rowcount
+                self.repo.conn.commit()
+                cursor.close()
+            deleted += count
+            if count < self.chunk_size:
+                break
+            self.stopped.wait(self.pause)
+        return deleted
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                deleted = self.run_once()
+                if deleted:
+                    logging.info(f"Retention removed {deleted} expired rows")
+            except Exception:
+                logging.exception("Retention run failed")
+            self.stopped.wait(self.interval)
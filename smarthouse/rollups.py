@@ -0,0 +1,179 @@
+"""
+Pre-aggregated hourly and daily statistics (count/sum/min/max) per device and unit.
+
+The rollup tables are kept current by `SmartHouseRepository` whenever measurements are
+added or deleted through it. Rebuilding them from the raw measurements (after the tables
+were created by the schema migration, or for readings that were written to `measurements`
+by other means) is recorded in `rollups_pending` and worked off one device per transaction,
+either in the background by the API or offline with the backfill command:
+
+    python -m smarthouse.rollups data/db.sql [--from-date 2024-01-01] [--until-date 2024-01-31]
+
+Readings whose timestamp SQLite cannot parse are kept in `measurements` but left out of
+the rollups.
+"""
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Iterable, Tuple
+
+# Tabellnavn og strftime-format for bøtten hver måling havner i
+ROLLUPS = {
+    "hourly": ("measurements_hourly", "%Y-%m-%d %H:00:00"),
+    "daily": ("measurements_daily", "%Y-%m-%d"),
+}
+
+# Lengden på bøttene i hver rollup
+SPANS = {
+    "hourly": timedelta(hours=1),
+    "daily": timedelta(days=1),
+}
+
+CREATE_TABLES = "".join(f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        device TEXT NOT NULL,
+        unit TEXT NOT NULL DEFAULT '',
+        bucket TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        minimum REAL NOT NULL,
+        maximum REAL NOT NULL,
+        PRIMARY KEY (device, unit, bucket)
+    );
+    CREATE INDEX IF NOT EXISTS {table}_unit_bucket ON {table} (unit, bucket);
+""" for table, _ in ROLLUPS.values())
+
+
+# Arbeid som gjenstår for backfill: tidsrom, og den siste enheten (i id-rekkefølge) som er ferdig
+CREATE_PENDING = """
+    CREATE TABLE IF NOT EXISTS rollups_pending (
+        start TEXT NOT NULL,
+        end TEXT NOT NULL,
+        device TEXT NOT NULL DEFAULT ''
+    );
+"""
+
+# Per enhet: tidspunktet retention har slettet rådata før. Aggregatene før dette kan ikke
+# bygges opp igjen fra rådata og røres derfor ikke av backfill.
+CREATE_WATERMARKS = """
+    CREATE TABLE IF NOT EXISTS rollups_watermarks (
+        device TEXT PRIMARY KEY,
+        raw_before TEXT NOT NULL
+    );
+"""
+
+# Registrerer en backfill av alle eksisterende målinger (brukes av migreringen)
+PENDING_ALL = "INSERT INTO rollups_pending (start, end) VALUES ('', '9999-12-31T23:59:59');"
+
+
+def upsert_sql(table: str, fmt: str) -> str:
+    # INSERT ... SELECT slik at rader med et tidsstempel strftime ikke forstår kan hoppes over
+    return f"""
+        INSERT INTO {table} (device, unit, bucket, count, total, minimum, maximum)
+        SELECT ?1, COALESCE(?4, ''), strftime('{fmt}', ?2), 1, ?3, ?3, ?3
+        WHERE strftime('{fmt}', ?2) IS NOT NULL
+        ON CONFLICT (device, unit, bucket) DO UPDATE SET
+            count = count + 1,
+            total = total + excluded.total,
+            minimum = MIN(minimum, excluded.minimum),
+            maximum = MAX(maximum, excluded.maximum)
+    """
+
+
+def aggregate_sql(table: str, fmt: str, where: str) -> str:
+    return f"""
+        INSERT INTO {table} (device, unit, bucket, count, total, minimum, maximum)
+        SELECT device, COALESCE(unit, ''), strftime('{fmt}', ts), COUNT(*), SUM(value), MIN(value), MAX(value)
+        FROM measurements
+        WHERE ({where}) AND strftime('{fmt}', ts) IS NOT NULL
+        GROUP BY device, COALESCE(unit, ''), strftime('{fmt}', ts)
+    """
+
+
+def add(cursor: sqlite3.Cursor, rows: Iterable[Tuple[str, str, float, str]]):
+    """
+    Folds `(device, ts, value, unit)` rows into every rollup table.
+    Must run in the same transaction as the insert into `measurements`.
+    """
+    rows = list(rows)
+    for table, fmt in ROLLUPS.values():
+        cursor.executemany(upsert_sql(table, fmt), rows)
+
+
+def refresh(cursor: sqlite3.Cursor, device: str, ts: str):
+    """
+    Recomputes the buckets containing `ts` for the given device from the raw
+    measurements, e.g. after a measurement has been deleted.
+    """
+    for table, fmt in ROLLUPS.values():
+        cursor.execute(f"DELETE FROM {table} WHERE device = ?1 AND bucket = strftime('{fmt}', ?2)", (device, ts))
+        # Avgrenser først til døgnet slik at indeksen på (device, ts) brukes
+        cursor.execute(aggregate_sql(table, fmt, f"""
+            device = ?1 AND ts >= date(?2) AND ts < date(?2, '+1 day')
+            AND strftime('{fmt}', ts) = strftime('{fmt}', ?2)
+        """), (device, ts))
+
+
+def bucket_of(kind: str, moment: datetime) -> str:
+    """
+    The bucket of the given rollup ("hourly" or "daily") containing `moment`.
+    """
+    return moment.strftime(ROLLUPS[kind][1])
+
+
+def first_bucket_from(kind: str, ts: str) -> str:
+    """
+    The first bucket of the given rollup that starts at or after `ts`.
+    """
+    moment = datetime.fromisoformat(ts)
+    fmt = ROLLUPS[kind][1]
+    start = datetime.strptime(moment.strftime(fmt), fmt)
+    if start < moment:
+        start += SPANS[kind]
+    return start.strftime(fmt)
+
+
+def record_watermark(cursor: sqlite3.Cursor, device: str, raw_before: str):
+    """
+    Records that the raw measurements of the device before `raw_before` have been deleted.
+    """
+    cursor.execute("""
+        INSERT INTO rollups_watermarks (device, raw_before) VALUES (?, ?)
+        ON CONFLICT (device) DO UPDATE SET raw_before = MAX(raw_before, excluded.raw_before)
+    """, (device, raw_before))
+
+
+def backfill(cursor: sqlite3.Cursor, start: str, end: str, device: str):
+    """
+    Rebuilds the rollup buckets of one device for measurements with `start <= ts < end`.
+    Both bounds must fall on day boundaries, as returned by `persistence.day_range`.
+    Buckets that reach back before the device's watermark are left alone, since their
+    raw measurements have (partly) been deleted by retention.
+    """
+    cursor.execute("SELECT raw_before FROM rollups_watermarks WHERE device = ?", (device,))
+    watermark = cursor.fetchone()
+    for kind, (table, fmt) in ROLLUPS.items():
+        first = max(start, first_bucket_from(kind, watermark[0])) if watermark else start
+        if first >= end:
+            continue
+        cursor.execute(f"DELETE FROM {table} WHERE device = ?3 AND bucket >= ?1 AND bucket < ?2", (first, end, device))
+        # Avgrenset til én enhet, så indeksen på (device, ts) brukes
+        cursor.execute(aggregate_sql(table, fmt, "device = ?3 AND ts >= ?1 AND ts < ?2"), (first, end, device))
+
+
+def main():
+    from smarthouse.persistence import SmartHouseRepository
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database")
+    parser.add_argument("--from-date", default=None)
+    parser.add_argument("--until-date", default=None)
+    args = parser.parse_args()
+
+    repo = SmartHouseRepository(args.database)
+    devices = repo.backfill_rollups(args.from_date, args.until_date)
+    print(f"Rebuilt rollups in {args.database} ({devices} device ranges)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Fast JSON encoding of domain objects for the API.
+
+The functions build plain dicts straight from the domain objects instead of constructing
+and validating a pydantic model per item, and encode them with orjson when it is installed
+(the standard json module is used otherwise). The output is the same as FastAPI produces
+through the corresponding response models, so the OpenAPI contract is unchanged.
+"""
+import json
+from typing import Iterable, List, Optional, Tuple
+
+from smarthouse.domain import Device, Measurement
+
+try:
+    import orjson
+except ImportError:  # orjson er valgfri
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """
+    Encodes the given data as compact UTF-8 JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def device_dict(device: Device) -> dict:
+    """
+    The fields of `DeviceModel` for the given device.
+    """
+    return {
+        "id": device.id,
+        "kind": device.device_type,
+        "supplier": device.supplier,
+        "product": device.model_name,
+    }
+
+
+def iso_timestamp(ts: str) -> str:
+    # Databasen lagrer "YYYY-MM-DD HH:MM:SS"; pydantic skriver datetime som ISO 8601 med "T"
+    return ts.replace(" ", "T", 1)
+
+
+def measurement_dict(device_id: str, ts: str, value: float, unit: Optional[str]) -> dict:
+    """
+    The fields of `MeasurementModel` for a single reading.
+    """
+    return {"device": device_id, "value": float(value), "unit": unit, "timestamp": iso_timestamp(ts)}
+
+
+def encode_devices(devices: Iterable[Device]) -> bytes:
+    """
+    Encodes the devices as a JSON array of `DeviceModel` objects.
+    """
+    return dumps([device_dict(device) for device in devices])
+
+
+def encode_measurements(device_id: str, measurements: List[Measurement]) -> bytes:
+    """
+    Encodes the readings of a sensor as a JSON array of `MeasurementModel` objects.
+    """
+    return dumps([measurement_dict(device_id, m.timestamp, m.value, m.unit) for m in measurements])
+
+
+def encode_measurement_rows(device_id: str, rows: Iterable[Tuple[str, float, str]]) -> bytes:
+    """
+    Encodes (timestamp, value, unit) rows as newline-delimited JSON objects.
+    """
+    return b"".join(dumps(measurement_dict(device_id, ts, value, unit)) + b"\n" for ts, value, unit in rows)
@@ -0,0 +1,42 @@
+import unittest
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from smarthouse import analytics  # noqa: E402
+from smarthouse.persistence import SmartHouseRepository  # noqa: E402
+
+
+class AnalyticsTest(unittest.TestCase):
+    # NumPy er en valgfri avhengighet, så disse testene hoppes over uten den
+    file = Path(__file__).parent / "../data/db.sql"
+    repo = SmartHouseRepository(file)
+
+    def test_matches_sql(self):
+        h = self.repo.load_smarthouse_deep()
+        for room in h.get_rooms():
+            for from_date, until_date in [(None, None), ('2024-01-27', None), (None, '2024-01-26')]:
+                expected = self.repo.calc_avg_temperatures_in_room(room, from_date, until_date)
+                actual = analytics.avg_temperatures_in_room(self.repo, room, from_date, until_date)
+                self.assertEqual(expected.keys(), actual.keys())
+                for k in expected.keys():
+                    self.assertAlmostEqual(expected[k], actual[k], 9)
+            self.assertSetEqual(set(self.repo.calc_hours_with_humidity_above(room, '2024-01-27')),
+                                set(analytics.hours_with_humidity_above(self.repo, room, '2024-01-27')))
+
+    def test_operations(self):
+        series = analytics.Series(np.array([0.0, 60.0, 3600.0, 3660.0, 7200.0]),
+                                  np.array([1.0, 3.0, 5.0, 7.0, 100.0]), "°C")
+        buckets, means = analytics.resample(series, analytics.HOUR)
+        self.assertEqual([0.0, 3600.0, 7200.0], list(buckets))
+        self.assertEqual([2.0, 6.0, 100.0], list(means))
+        self.assertEqual([2.0, 4.0, 6.0], list(analytics.rolling_mean(series.values[:4], 2)))
+        self.assertEqual([1, 2, 1], list(analytics.threshold_counts_per_hour(series, 2.0)[:3]))
+        self.assertEqual(5.0, analytics.percentiles(series, 50))
+        self.assertEqual([4], list(analytics.anomalies(series, limit=1.5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+# API-et åpner databasen når modulen importeres, så den pekes til en kopi først
+_tmp = tempfile.TemporaryDirectory()
+_db_file = Path(_tmp.name) / "db.sql"
+_source, _target = sqlite3.connect(Path(__file__).parent / "../data/db.sql"), sqlite3.connect(_db_file)
+_source.backup(_target)
+_source.close()
+_target.close()
+os.environ["SMARTHOUSE_DB"] = str(_db_file)
+
+from smarthouse import api  # noqa: E402
+from smarthouse.events import EventBus  # noqa: E402
+from smarthouse.models import MeasurementModel  # noqa: E402
+from smarthouse.serialization import encode_measurements  # noqa: E402
+
+SENSOR = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+ACTUATOR = "9a54c1ec-0cb5-45a7-b20d-2a7349f1b132"
+UNKNOWN = "00000000-0000-4000-8000-000000000000"
+OVEN = "8d4e4c98-21a9-4d1e-bf18-523285ad90f6"
+
+
+def tearDownModule():
+    api.repo.close()
+    _tmp.cleanup()
+
+
+class ApiTestCase(unittest.TestCase):
+    # Hver testklasse kjører sin egen lifespan (oppstart og nedstenging av bakgrunnstrådene)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(api.app)
+        cls.client.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_encode_measurements(self):
+        # the direct encoder produces the same JSON as the pydantic response model
+        measurements = api.repo.get_latest_sensor_measurements(SENSOR, limit=10)
+        models = [MeasurementModel(device=SENSOR, timestamp=m.timestamp, value=m.value, unit=m.unit) for m in measurements]
+        self.assertEqual(TypeAdapter(List[MeasurementModel]).dump_json(models), encode_measurements(SENSOR, measurements))
+
+
+class SensorMeasurementApiTest(ApiTestCase):
+
+    def test_batch_insert(self):
+        batch = [{"device": SENSOR, "value": 20.0 + i, "unit": "°C", "timestamp": f"2033-01-01 00:0{i}:00"} for i in range(3)]
+        response = self.client.post("/smarthouse/sensor/measurements:batch", json=batch)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"inserted": 3}, response.json())
+        current = self.client.get(f"/smarthouse/sensor/{SENSOR}/current").json()
+        self.assertEqual(22.0, current["value"])
+
+    def test_batch_deferred(self):
+        batch = [{"device": SENSOR, "value": 19.5, "unit": "°C", "timestamp": "2031-02-01 00:00:00"}]
+        response = self.client.post("/smarthouse/sensor/measurements:batch", params={"deferred": "true"}, json=batch)
+        self.assertEqual({"queued": 1}, response.json())
+        api.measurement_writer.flush()
+
+    def test_batch_missing_timestamp_defaults_to_now(self):
+        for measurement in [{"device": SENSOR, "value": 21.0, "unit": "°C"},
+                            {"device": SENSOR, "value": 21.0, "unit": "°C", "timestamp": None}]:
+            response = self.client.post("/smarthouse/sensor/measurements:batch", json=[measurement])
+            self.assertEqual(200, response.status_code)
+
+    def test_batch_unknown_sensor(self):
+        response = self.client.post("/smarthouse/sensor/measurements:batch",
+                                    json=[{"device": UNKNOWN, "value": 1.0, "unit": "°C"}])
+        self.assertEqual(404, response.status_code)
+        self.assertIn(UNKNOWN, response.json()["detail"])
+
+    def test_batch_rejects_actuator(self):
+        response = self.client.post("/smarthouse/sensor/measurements:batch",
+                                    json=[{"device": ACTUATOR, "value": 1.0, "unit": "°C"}])
+        self.assertEqual(422, response.status_code)
+        self.assertIn(ACTUATOR, response.json()["detail"])
+
+    def test_batch_invalid_body(self):
+        for batch in [[{"device": SENSOR, "unit": "°C"}],
+                      [{"device": "not-a-uuid", "value": 1.0, "unit": "°C"}],
+                      [{"device": SENSOR, "value": 1.0, "unit": "°C", "timestamp": "yesterday"}]]:
+            response = self.client.post("/smarthouse/sensor/measurements:batch", json=batch)
+            self.assertEqual(422, response.status_code)
+
+    def test_values_pages_through_equal_timestamps(self):
+        batch = [{"device": SENSOR, "value": float(i), "unit": "°C", "timestamp": "2032-01-01 00:00:00"} for i in range(5)]
+        self.client.post("/smarthouse/sensor/measurements:batch", json=batch)
+        values = []
+        params = {"limit": 2, "after": "2031-12-31 23:59:59", "before": "2032-01-02 00:00:00"}
+        while True:
+            response = self.client.get(f"/smarthouse/sensor/{SENSOR}/values", params=params)
+            values += [m["value"] for m in response.json()]
+            if "X-Next-Before" not in response.headers:
+                break
+            params["before"] = response.headers["X-Next-Before"]
+        self.assertEqual([4.0, 3.0, 2.0, 1.0, 0.0], values)
+        lines = self.client.get(f"/smarthouse/sensor/{SENSOR}/values",
+                                params={"format": "ndjson", "after": "2031-12-31 23:59:59", "before": "2032-01-02"}).text.splitlines()
+        self.assertEqual(5, len(lines))
+        rows = self.client.get(f"/smarthouse/sensor/{SENSOR}/values",
+                               params={"format": "csv", "after": "2031-12-31 23:59:59", "before": "2032-01-02"}).text.splitlines()
+        self.assertEqual(6, len(rows))
+        self.assertEqual(422, self.client.get(f"/smarthouse/sensor/{SENSOR}/values", params={"before": "x|y"}).status_code)
+
+
+class ConditionalGetTest(ApiTestCase):
+
+    def test_not_modified_until_changed(self):
+        response = self.client.get("/smarthouse/floor")
+        self.assertEqual(200, response.status_code)
+        etag = response.headers["ETag"]
+        cached = self.client.get("/smarthouse/floor", headers={"If-None-Match": etag})
+        self.assertEqual(304, cached.status_code)
+        self.assertEqual(etag, cached.headers["ETag"])
+        self.assertEqual(b"", cached.content)
+        api.smarthouse.mark_changed()
+        changed = self.client.get("/smarthouse/floor", headers={"If-None-Match": etag})
+        self.assertEqual(200, changed.status_code)
+        self.assertNotEqual(etag, changed.headers["ETag"])
+        self.assertEqual(response.json(), changed.json())
+
+    def test_actuator_update_changes_etag(self):
+        etag = self.client.get("/smarthouse/device").headers["ETag"]
+        self.client.put(f"/smarthouse/actuator/{OVEN}", json={"state": 180.0})
+        response = self.client.get("/smarthouse/device", headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["ETag"])
+
+
+class TemperatureStatsApiTest(ApiTestCase):
+    # Avgrenset til dataene i databasen, siden andre tester skriver målinger langt fram i tid
+
+    def test_floor_stats(self):
+        response = self.client.get("/smarthouse/floor/1/stats/temperature",
+                                   params={"from_date": "2024-01-25", "until_date": "2024-12-31"})
+        self.assertEqual(200, response.status_code)
+        floor = api.smarthouse.get_floor(1)
+        self.assertEqual([room.room_name for room in floor.rooms], [r["room_name"] for r in response.json()])
+        for room, result in zip(floor.rooms, response.json()):
+            self.assertEqual(api.repo.calc_avg_temperatures_in_room(room, "2024-01-25", "2024-12-31"), result["averages"])
+        self.assertTrue(any(r["averages"] for r in response.json()))
+
+    def test_unknown_floor(self):
+        response = self.client.get("/smarthouse/floor/99/stats/temperature")
+        self.assertEqual(404, response.status_code)
+        self.assertIn("99", response.json()["detail"])
+
+    def test_invalid_dates(self):
+        for params in [{"from_date": "garbage"}, {"until_date": "2024-13-01"}]:
+            self.assertEqual(422, self.client.get("/smarthouse/floor/1/stats/temperature", params=params).status_code)
+            self.assertEqual(422, self.client.get("/smarthouse/stats/temperature", params=params).status_code)
+
+    def test_house_stats(self):
+        response = self.client.get("/smarthouse/stats/temperature", params={"until_date": "2024-12-31"})
+        self.assertEqual(200, response.status_code)
+        rooms = api.smarthouse.get_rooms()
+        self.assertEqual([(room.floor.level, room.room_name) for room in rooms],
+                         [(r["floor_level"], r["room_name"]) for r in response.json()])
+        for room, result in zip(rooms, response.json()):
+            self.assertEqual(api.repo.calc_avg_temperatures_in_room(room, None, "2024-12-31"), result["averages"])
+
+
+class EventBusTest(unittest.TestCase):
+
+    def test_publish_filter_unsubscribe(self):
+        async def scenario():
+            bus = EventBus()
+            everything = bus.subscribe()
+            garage = bus.subscribe(rooms=["Garage"])
+            oven = bus.subscribe(devices=[OVEN])
+            bus.publish({"type": "actuator", "device": ACTUATOR, "room": "Garage", "state": True})
+            bus.unsubscribe(oven)
+            bus.publish({"type": "actuator", "device": OVEN, "room": "Guest Room 1", "state": True})
+            # publish leverer via call_soon_threadsafe, så løkken må få kjøre først
+            await asyncio.sleep(0)
+            return ([e["device"] for e in drain(everything)], [e["device"] for e in drain(garage)],
+                    [e["device"] for e in drain(oven)], len(bus.subscriptions))
+
+        self.assertEqual(([ACTUATOR, OVEN], [ACTUATOR], [], 2), asyncio.run(scenario()))
+
+
+def drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+
+class EventsApiTest(ApiTestCase):
+
+    def test_websocket_round_trip(self):
+        with self.client.websocket_connect("/smarthouse/ws", params={"device": ACTUATOR}) as websocket:
+            self.client.put(f"/smarthouse/actuator/{OVEN}", json={"state": True})
+            self.client.put(f"/smarthouse/actuator/{ACTUATOR}", json={"state": True})
+            event = websocket.receive_json()
+        self.assertEqual({"type": "actuator", "device": ACTUATOR, "room": "Garage", "state": True}, event)
+
+    def test_websocket_disconnect_unsubscribes(self):
+        # TestClient avbryter endepunktet når forbindelsen lukkes; det gjør ikke uvicorn, så
+        # endepunktet må selv merke at klienten går, også når det ikke kommer hendelser
+        class DisconnectingWebSocket:
+            async def accept(self):
+                pass
+
+            async def receive(self):
+                return {"type": "websocket.disconnect", "code": 1000}
+
+            async def send_json(self, data):
+                pass
+
+        async def scenario():
+            await asyncio.wait_for(api.websocket_events(DisconnectingWebSocket(), [UNKNOWN], []), timeout=5)
+
+        asyncio.run(scenario())
+        self.assertEqual(0, len(api.events.subscriptions))
+
+
+class SlowTransport(httpx.ASGITransport):
+    # Holder sendingene underveis lenge nok til at nedstengingen må vente på dem
+
+    async def handle_async_request(self, request):
+        await asyncio.sleep(0.05)
+        return await super().handle_async_request(request)
+
+
+class FleetApiTest(ApiTestCase):
+
+    def test_fleet_sends_everything_before_closing(self):
+        # Klientmappen legges bakerst, så client/smarthouse.py ikke skygger for pakken smarthouse
+        sys.path.append(str(Path(__file__).parent / "../client"))
+        fleet = pytest.importorskip("fleet")
+        sensors = [d for d in fleet.read_database_manifest(_db_file) if d.category == "sensor"]
+        stored = count_measurements()
+        # Små batcher og lang flush_interval: mye er fortsatt i bufferen eller underveis ved nedstengingen
+        simulation = fleet.Fleet(sensors, base_url="http://testserver/smarthouse/", interval=0.01,
+                                 flush_interval=60, batch_size=7, transport=SlowTransport(app=api.app))
+        with mock.patch.object(simulation, "buffer_reading", wraps=simulation.buffer_reading) as buffered:
+            stats = asyncio.run(simulation.run(duration=0.3))
+        api.measurement_writer.flush()
+        self.assertEqual(0, stats.errors)
+        self.assertEqual(buffered.call_count, stats.readings)
+        self.assertEqual([], simulation.buffer)
+        self.assertEqual(stored + stats.readings, count_measurements())
+
+
+def count_measurements() -> int:
+    c = api.repo.cursor()
+    c.execute("SELECT COUNT(*) FROM measurements")
+    count = c.fetchone()[0]
+    c.close()
+    return count
+
+
+class LifespanTest(unittest.TestCase):
+
+    def test_lifespan_restarts(self):
+        # en andre lifespan i samme prosess (ny TestClient, uvicorn --reload) må kunne bruke databasen
+        for _ in range(2):
+            with TestClient(api.app) as client:
+                self.assertEqual(200, client.get(f"/smarthouse/sensor/{SENSOR}/values", params={"limit": 1}).status_code)
+                self.assertEqual(200, client.get("/smarthouse/stats/temperature").status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
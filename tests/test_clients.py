@@ -0,0 +1,76 @@
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+# Klientene importerer common og messaging som moduler på toppnivå; mappen legges bakerst,
+# så client/smarthouse.py ikke skygger for pakken smarthouse
+sys.path.append(str(Path(__file__).parent / "../client"))
+
+import common  # noqa: E402
+from smarthouse_temperature_sensor import Sensor  # noqa: E402
+
+DATA = Path(__file__).parent / "../data/db.sql"
+MANIFEST = Path(__file__).parent / "Bookofmormons.csv"
+
+
+def response(status: int) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    return r
+
+
+class TemperatureSensorFlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sensor = Sensor(common.TEMPERATURE_SENSOR_DID)
+        self.sensor.buffer_reading(21.0)
+
+    def flush(self, **post):
+        with mock.patch.object(common.session(), "post", **post):
+            return self.sensor.flush()
+
+    def test_sent_batch_leaves_buffer(self):
+        self.assertTrue(self.flush(return_value=response(200)))
+        self.assertEqual(0, len(self.sensor.buffer))
+
+    def test_rejected_batch_is_dropped(self):
+        self.assertTrue(self.flush(return_value=response(422)))
+        self.assertEqual(0, len(self.sensor.buffer))
+
+    def test_server_error_is_retried(self):
+        self.assertFalse(self.flush(return_value=response(503)))
+        self.assertEqual(1, len(self.sensor.buffer))
+
+    def test_connection_error_is_retried(self):
+        self.assertFalse(self.flush(side_effect=requests.ConnectionError("refused")))
+        self.assertEqual(1, len(self.sensor.buffer))
+
+
+class FleetManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = pytest.importorskip("fleet")
+
+    def test_csv_and_database_manifests_agree(self):
+        from_csv = self.fleet.read_csv_manifest(MANIFEST)
+        from_database = self.fleet.read_database_manifest(DATA)
+        self.assertEqual(len(from_database), len(from_csv))
+        # Kategoriene er ikke helt like i de to kildene (stekeovnen), så bare enhetene sammenlignes
+        self.assertEqual({d.did for d in from_database}, {d.did for d in from_csv})
+        self.assertEqual({"sensor", "actuator"}, {d.category for d in from_csv})
+
+    def test_fleet_simulates_known_devices(self):
+        devices = self.fleet.read_csv_manifest(MANIFEST)
+        fleet = self.fleet.Fleet(devices)
+        self.assertEqual(len([d for d in devices if d.category == "actuator"]), len(fleet.actuators))
+        self.assertTrue(all(s.unit for s in fleet.sensors))
+        self.assertIn(common.TEMPERATURE_SENSOR_DID, [s.did for s in fleet.sensors])
+
+
+if __name__ == '__main__':
+    unittest.main()
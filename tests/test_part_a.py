@@ -25,6 +25,44 @@ class TestPartA(TestCase):
         self.assertEqual(l.id, "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e")
         self.assertTrue(l in h.get_devices())
 
+    def test_basic_get_floor_and_room(self):
+        # floor level that does not exist
+        self.assertIsNone(h.get_floor(3))
+        ground_floor = h.get_floor(1)
+        self.assertIsNotNone(ground_floor)
+        self.assertEqual(ground_floor.level, 1)
+        # registering an existing level yields the same floor
+        self.assertIs(h.register_floor(1), ground_floor)
+        garage = h.get_room(ground_floor, "Garage")
+        self.assertIsNotNone(garage)
+        self.assertEqual(garage.room_size, 19)
+        # rooms are looked up per floor
+        self.assertIsNone(h.get_room(h.get_floor(2), "Garage"))
+
+    def test_basic_floor_summaries(self):
+        self.assertEqual(h.get_no_rooms(), len(h.get_rooms()))
+        self.assertEqual(h.get_no_devices(), len(h.get_devices()))
+        for floor in h.get_floors():
+            self.assertAlmostEqual(floor.area, sum(r.room_size for r in floor.rooms))
+            self.assertEqual(floor.no_devices, sum(len(r.devices) for r in floor.rooms))
+        self.assertAlmostEqual(h.get_floor(1).area, 86.55)
+        self.assertEqual(h.get_floor(2).no_devices, 6)
+
+    def test_basic_version_bumps_on_change(self):
+        house = SmartHouse()
+        version = house.version
+        floor = house.register_floor(1)
+        self.assertGreater(house.version, version)
+        version = house.version
+        # registering an existing level changes nothing
+        house.register_floor(1)
+        self.assertEqual(house.version, version)
+        house.register_room(floor, 10.0, "Office")
+        self.assertGreater(house.version, version)
+        version = house.version
+        house.mark_changed()
+        self.assertGreater(house.version, version)
+
 
     # Level 2 Intermediate: Testing the attributes and methods of device object
 
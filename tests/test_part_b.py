@@ -1,5 +1,13 @@
+import gc
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from smarthouse.persistence import SmartHouseRepository
+from unittest import mock
+from smarthouse.persistence import SmartHouseRepository, MeasurementWriter, ActuatorStateWriter, SCHEMA_MIGRATIONS
+from smarthouse.retention import RetentionEngine, RetentionPolicy
+from datetime import datetime
 from pathlib import Path
 
 class SmartHouseTest(unittest.TestCase):
@@ -13,6 +21,14 @@ class SmartHouseTest(unittest.TestCase):
         self.assertEqual(12, len(rooms))
         c.close()
 
+    def test_schema_migrated(self):
+        c = self.repo.cursor()
+        c.execute("PRAGMA user_version")
+        self.assertEqual(len(SCHEMA_MIGRATIONS), c.fetchone()[0])
+        c.execute("EXPLAIN QUERY PLAN SELECT ts, value, unit FROM measurements WHERE device = ? ORDER BY ts DESC LIMIT 1", ("x",))
+        self.assertIn("INDEX", c.fetchone()[3])
+        c.close()
+
     # Testing that the device structure is loaded correctly
 
     def test_basic_no_of_rooms(self):
@@ -46,6 +62,33 @@ class SmartHouseTest(unittest.TestCase):
         self.assertEqual('2024-01-29 16:00:01', self.repo.get_latest_reading(humidity_sensor).timestamp)
 
 
+    def test_intermediate_paginate_measurements(self):
+        sensor = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+        everything = self.repo.get_latest_sensor_measurements(sensor)
+        pages = []
+        before = None
+        while True:
+            page = self.repo.get_latest_sensor_measurements(sensor, limit=5, before=before)
+            if not page:
+                break
+            pages.extend(page)
+            before = page[-1].timestamp
+        self.assertEqual([m.timestamp for m in everything], [m.timestamp for m in pages])
+        newest = self.repo.get_latest_sensor_measurements(sensor, after='2024-01-28 10:00:00')
+        self.assertEqual(['2024-01-28 16:00:00', '2024-01-28 14:00:00', '2024-01-28 12:00:00'], [m.timestamp for m in newest])
+
+    def test_intermediate_sensor_series(self):
+        sensor = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+        series = self.repo.get_sensor_series(sensor)
+        everything = self.repo.get_latest_sensor_measurements(sensor)
+        self.assertEqual(len(everything), len(series))
+        self.assertEqual("°C", series.unit)
+        # oldest first, with the same readings as the row-per-object query
+        self.assertEqual([(m.timestamp, m.value) for m in reversed(everything)], [(m.timestamp, m.value) for m in series])
+        window = self.repo.get_sensor_series(sensor, start='2024-01-28 12:00:00', end='2024-01-28 16:00:00')
+        self.assertEqual(['2024-01-28 12:00:00', '2024-01-28 14:00:00'], [m.timestamp for m in window])
+        self.assertEqual(0, len(self.repo.get_sensor_series(sensor, unit="%")))
+
     def test_intermediate_save_actuator_state(self):
         h = self.repo.load_smarthouse_deep()
         oven = h.get_device_by_id("8d4e4c98-21a9-4d1e-bf18-523285ad90f6")
@@ -132,7 +175,287 @@ class SmartHouseTest(unittest.TestCase):
         for k in expected3.keys():
             self.assertAlmostEqual(expected3[k], actual3[k], 3)
 
+    def test_zadvanced_test_temp_avgs_batch(self):
+        h = self.repo.load_smarthouse_deep()
+        for rooms in [h, h.get_floor(2), h.get_rooms()[:3]]:
+            result = self.repo.calc_avg_temperatures_in_rooms(rooms, '2024-01-25', None)
+            expected_rooms = h.get_rooms() if rooms is h else rooms.rooms if rooms is h.get_floor(2) else rooms
+            self.assertEqual(set(expected_rooms), set(result.keys()))
+            for room, averages in result.items():
+                self.assertEqual(self.repo.calc_avg_temperatures_in_room(room, '2024-01-25', None), averages)
+        self.assertEqual({}, self.repo.calc_avg_temperatures_in_rooms([]))
+
+
+class MeasurementIngestionTest(unittest.TestCase):
+    # Skriver til en kopi av databasen slik at de andre testene ikke påvirkes
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        file = Path(self.tmp.name) / "db.sql"
+        # backup tar med endringer som fortsatt ligger i WAL-filen
+        source, target = sqlite3.connect(SmartHouseTest.file), sqlite3.connect(file)
+        source.backup(target)
+        source.close()
+        target.close()
+        self.file = file
+        self.repo = SmartHouseRepository(file)
+        self.repo.backfill_pending_rollups()
+        self.sensor = "4d8b1d62-7921-4917-9b70-bbd31f6e2e8e"
+
+    def tearDown(self):
+        del self.repo
+        self.tmp.cleanup()
+
+    def test_add_measurements(self):
+        rows = [(self.sensor, f"2030-01-01 00:0{i}:00", 20.0 + i, "°C") for i in range(5)]
+        self.assertEqual(5, self.repo.add_measurements(rows))
+        latest = self.repo.get_latest_reading(self.sensor)
+        self.assertEqual("2030-01-01 00:04:00", latest.timestamp)
+        self.assertEqual(24.0, latest.value)
+
+    def test_paginate_equal_timestamps(self):
+        # flere målinger med samme tidsstempel på tvers av en sidegrense
+        rows = [(self.sensor, "2030-01-01 00:00:00", float(i), "°C") for i in range(7)]
+        rows += [(self.sensor, "2030-01-01 00:00:01", 100.0, "°C")]
+        self.repo.add_measurements(rows)
+        pages = []
+        before = None
+        while True:
+            page, before = self.repo.get_sensor_measurements_page(self.sensor, limit=3, before=before, after="2029-12-31 23:59:59")
+            pages.append([m.value for m in page])
+            if before is None:
+                break
+        self.assertEqual([[100.0, 6.0, 5.0], [4.0, 3.0, 2.0], [1.0, 0.0]], pages)
+        streamed = list(self.repo.iter_sensor_measurements(self.sensor, after="2029-12-31 23:59:59", chunk_size=2))
+        self.assertEqual([100.0, 6.0, 5.0, 4.0, 3.0, 2.0, 1.0, 0.0], [value for _, value, _ in streamed])
+        self.assertEqual(5, len(list(self.repo.iter_sensor_measurements(self.sensor, limit=5, chunk_size=2))))
+        # et rent tidsstempel som `before` utelukker alle målingene med det tidsstempelet
+        self.assertEqual([], self.repo.get_latest_sensor_measurements(self.sensor, before="2030-01-01 00:00:00", after="2029-12-31 23:59:59"))
+
+    def test_connections_per_live_thread(self):
+        self.repo.conn
+        threads = [threading.Thread(target=lambda: self.repo.get_latest_reading(self.sensor)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        # forbindelsene til avsluttede tråder er lukket og glemt
+        gc.collect()
+        self.assertEqual(1, len(self.repo.connections))
+        # close lukker bare egen forbindelse; en ny åpnes ved neste bruk
+        self.repo.close()
+        self.assertEqual(12, len(self.repo.load_smarthouse_deep().get_rooms()))
+        self.assertEqual(1, len(self.repo.connections))
+
+    def test_measurement_writer(self):
+        writer = MeasurementWriter(self.repo, flush_interval_ms=10, max_batch=2)
+        writer.start()
+        for i in range(5):
+            writer.submit(self.sensor, f"2030-01-01 00:0{i}:00", 20.0 + i, "°C")
+        writer.stop()
+        self.assertEqual(5, len(self.repo.get_latest_sensor_measurements(self.sensor, limit=5)))
+        self.assertEqual("2030-01-01 00:04:00", self.repo.get_latest_reading(self.sensor).timestamp)
+
+    def test_measurement_writer_survives_bad_batch(self):
+        writer = MeasurementWriter(self.repo, flush_interval_ms=10, max_batch=1)
+        add_measurements = self.repo.add_measurements
+        # den første batchen feiler med noe annet enn en databasefeil
+        failures = [RuntimeError("boom")]
+
+        def add(rows):
+            if failures:
+                raise failures.pop()
+            return add_measurements(rows)
+
+        with mock.patch.object(self.repo, "add_measurements", side_effect=add):
+            writer.start()
+            with self.assertLogs(level="ERROR"):
+                writer.submit(self.sensor, "2029-01-01 00:00:00", 20.0, "°C")
+                writer.submit(self.sensor, "2030-01-01 00:00:00", 20.0, "°C")
+                writer.stop()
+        self.assertEqual("2030-01-01 00:00:00", self.repo.get_latest_reading(self.sensor).timestamp)
+
+    def test_measurement_writer_retries_locked_database(self):
+        writer = MeasurementWriter(self.repo, flush_interval_ms=10, max_batch=10, retry_interval_ms=10)
+        add_measurements = self.repo.add_measurements
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def add(rows):
+            if failures:
+                raise failures.pop()
+            return add_measurements(rows)
+
+        with mock.patch.object(self.repo, "add_measurements", side_effect=add):
+            writer.start()
+            with self.assertLogs(level="ERROR"):
+                writer.submit(self.sensor, "2030-01-01 00:00:00", 20.0, "°C")
+                while failures:
+                    time.sleep(0.01)
+                writer.stop()
+        self.assertEqual("2030-01-01 00:00:00", self.repo.get_latest_reading(self.sensor).timestamp)
+
+    def test_rollups(self):
+        rows = [(self.sensor, f"2030-01-01 0{i}:00:00", 20.0 + i, "°C") for i in range(4)]
+        self.repo.add_measurements(rows)
+        c = self.repo.cursor()
+        c.execute("SELECT count, total, minimum, maximum FROM measurements_daily WHERE device = ? AND bucket = '2030-01-01'", (self.sensor,))
+        self.assertEqual((4, 86.0, 20.0, 23.0), c.fetchone())
+        c.execute("SELECT COUNT(*) FROM measurements_hourly WHERE device = ? AND bucket >= '2030-01-01'", (self.sensor,))
+        self.assertEqual(4, c.fetchone()[0])
+        # rader skrevet utenom repository-et blir med etter backfill
+        c.execute("INSERT INTO measurements (device, ts, value, unit) VALUES (?, '2030-01-01 05:00:00', 30.0, '°C')", (self.sensor,))
+        self.repo.conn.commit()
+        self.repo.backfill_rollups('2030-01-01', '2030-01-01')
+        c.execute("SELECT count, maximum FROM measurements_daily WHERE device = ? AND bucket = '2030-01-01'", (self.sensor,))
+        self.assertEqual((5, 30.0), c.fetchone())
+        c.close()
+        room = self.repo.load_smarthouse_deep().get_device_by_id(self.sensor).room
+        self.assertAlmostEqual(23.2, self.repo.calc_avg_temperatures_in_room(room, '2030-01-01', None)['2030-01-01'])
+
+    def test_rollups_skip_unparsable_timestamps(self):
+        self.repo.add_measurements([(self.sensor, "not a timestamp", 1.0, "°C"), (self.sensor, "2030-01-01 00:00:00", 20.0, "°C")])
+        self.repo.backfill_rollups()
+        c = self.repo.cursor()
+        c.execute("SELECT count FROM measurements_daily WHERE device = ? AND bucket = '2030-01-01'", (self.sensor,))
+        self.assertEqual(1, c.fetchone()[0])
+        c.execute("SELECT COUNT(*) FROM measurements WHERE device = ? AND ts = 'not a timestamp'", (self.sensor,))
+        self.assertEqual(1, c.fetchone()[0])
+        c.close()
+
+    def test_series_skips_unparsable_timestamps(self):
+        self.repo.add_measurements([(self.sensor, "2030-13-45 00:00:00", 1.0, "°C"), (self.sensor, "2030-01-01 00:00:00", 20.0, "°C")])
+        series = self.repo.get_sensor_series(self.sensor, start="2030-01-01", end="2031-01-01")
+        self.assertEqual([20.0], list(series.values))
+        self.assertTrue(all(ts is not None for ts in series.timestamps))
+
+    def test_migration_defers_rollup_backfill(self):
+        room = self.repo.load_smarthouse_deep().get_device_by_id(self.sensor).room
+        expected = self.repo.calc_avg_temperatures_in_room(room)
+        self.assertTrue(expected)
+        del self.repo
+        conn = sqlite3.connect(self.file)
+        conn.executescript("""
+            DROP TABLE measurements_hourly; DROP TABLE measurements_daily; DROP TABLE rollups_pending; DROP TABLE rollups_watermarks;
+            PRAGMA user_version = 1;
+        """)
+        conn.close()
+        # migreringen lager tabellene, men fyller dem ikke; til da svares det fra rådata
+        self.repo = SmartHouseRepository(self.file)
+        self.assertFalse(self.repo.rollups_ready('', '9999'))
+        raw = self.repo.calc_avg_temperatures_in_room(room)
+        self.assertEqual(expected.keys(), raw.keys())
+        for day in expected:
+            self.assertAlmostEqual(expected[day], raw[day], 9)
+        stopped = threading.Event()
+        stopped.set()
+        self.assertEqual(0, self.repo.backfill_pending_rollups(stopped))
+        self.assertGreater(self.repo.backfill_pending_rollups(), 0)
+        self.assertEqual(expected, self.repo.calc_avg_temperatures_in_room(room))
+        self.assertEqual(0, self.repo.backfill_pending_rollups())
+
+    def test_latest_reading_cache(self):
+        self.repo.warm_latest_readings()
+        self.assertEqual('2024-01-28 16:00:00', self.repo.get_latest_reading(self.sensor).timestamp)
+        # sensor uten målinger er også kjent etter oppvarming
+        self.assertIsNone(self.repo.get_latest_reading("cd5be4e8-0e6b-4cb5-a21f-819d06cf5fc5"))
+        self.assertEqual({"hits": 2, "misses": 0}, {k: v for k, v in self.repo.latest.stats().items() if k != "size"})
+        self.repo.add_measurement(self.sensor, "2030-01-01 00:00:00", 25.0, "°C")
+        self.assertEqual(25.0, self.repo.get_latest_reading(self.sensor).value)
+        # en eldre måling erstatter ikke den nyeste
+        self.repo.add_measurement(self.sensor, "2029-01-01 00:00:00", 5.0, "°C")
+        self.assertEqual(25.0, self.repo.get_latest_reading(self.sensor).value)
+        self.repo.delete_oldest_measurement_for_sensor(self.sensor)
+        self.assertEqual(25.0, self.repo.get_latest_reading(self.sensor).value)
+        self.assertEqual(1, self.repo.latest.misses)
+
+    def test_older_write_to_uncached_sensor(self):
+        # cachen er ikke fylt, så en eldre måling skal ikke gjelde som den siste
+        self.repo.add_measurement(self.sensor, "2020-01-01 00:00:00", 1.0, "°C")
+        self.assertEqual('2024-01-28 16:00:00', self.repo.get_latest_reading(self.sensor).timestamp)
 
+    def test_latest_reading_miss_races_with_write(self):
+        # en måling som skrives mens en bom leser databasen, skal vinne over den eldre raden
+        self.repo.latest.invalidate(self.sensor)
+
+        def write_during_fetch():
+            self.repo.add_measurement(self.sensor, "2031-01-01 00:00:00", 30.0, "°C")
+
+        writer = threading.Thread(target=write_during_fetch)
+        original_put = self.repo.latest.put
+
+        def put(sensor_id, measurement):
+            # skriveren starter mellom lesingen og put; den må vente på skrivelåsen
+            writer.start()
+            writer.join(0.2)
+            original_put(sensor_id, measurement)
+
+        with mock.patch.object(self.repo.latest, "put", side_effect=put):
+            self.repo.get_latest_reading(self.sensor)
+        writer.join()
+        self.assertEqual("2031-01-01 00:00:00", self.repo.get_latest_reading(self.sensor).timestamp)
+
+    def test_actuator_state_writer(self):
+        h = self.repo.load_smarthouse_deep()
+        oven = h.get_device_by_id("8d4e4c98-21a9-4d1e-bf18-523285ad90f6")
+        writer = ActuatorStateWriter(self.repo)
+        oven.turn_on(24.0)
+        writer.submit(oven)
+        oven.turn_off()
+        writer.submit(oven)
+        oven.turn_on(18.5)
+        writer.submit(oven)
+        # bare siste tilstand skrives
+        self.assertEqual(1, writer.flush())
+        self.assertEqual(0, writer.flush())
+        self.assertEqual(18.5, self.repo.get_actuator_state_by_id(oven.id).state)
+        self.assertEqual(18.5, self.repo.load_smarthouse_deep().get_device_by_id(oven.id).state)
+
+    def test_retention(self):
+        rows = [(self.sensor, f"2030-01-0{d} 0{h}:00:00", 20.0, "°C") for d in range(1, 4) for h in range(5)]
+        self.repo.add_measurements(rows)
+        engine = RetentionEngine(self.repo, {"Temperature Sensor": RetentionPolicy(raw_days=1, hourly_days=2)}, chunk_size=2)
+        deleted = engine.run_once(now=datetime(2030, 1, 3, 12))
+        c = self.repo.cursor()
+        # bare målingene fra siste døgn er igjen
+        c.execute("SELECT MIN(ts), COUNT(*) FROM measurements WHERE device = ?", (self.sensor,))
+        self.assertEqual(("2030-01-03 00:00:00", 5), c.fetchone())
+        # timesaggregatene tar vare på de to siste døgnene, døgnaggregatene alt
+        c.execute("SELECT MIN(bucket) FROM measurements_hourly WHERE device = ?", (self.sensor,))
+        self.assertEqual("2030-01-02 00:00:00", c.fetchone()[0])
+        c.execute("SELECT COUNT(*) FROM measurements_daily WHERE device = ? AND bucket >= '2030-01-01'", (self.sensor,))
+        self.assertEqual(3, c.fetchone()[0])
+        c.close()
+        self.assertGreater(deleted, 10)
+        # en annen sensortype uten policy er urørt
+        self.assertIsNotNone(self.repo.get_latest_reading("3d87e5c0-8716-4b0b-9c67-087eaaed7b45"))
+
+    def test_retention_then_backfill(self):
+        # målinger hver halvtime, så grensen for rådata (kl. 12:15) havner midt i en time
+        rows = [(self.sensor, f"2030-01-0{d} {h:02d}:{m:02d}:00", 20.0, "°C") for d in range(1, 4) for h in range(24) for m in (0, 30)]
+        self.repo.add_measurements(rows)
+        engine = RetentionEngine(self.repo, {"Temperature Sensor": RetentionPolicy(raw_days=1, hourly_days=None, daily_days=1)})
+        engine.run_once(now=datetime(2030, 1, 3, 12, 15))
+        # en full backfill bygger ikke om aggregatene for de slettede rådataene
+        self.repo.backfill_rollups()
+        c = self.repo.cursor()
+        c.execute("SELECT bucket, count FROM measurements_daily WHERE device = ? AND bucket >= '2030-01-01'", (self.sensor,))
+        # døgnet grensen for døgnaggregatene ligger i (2030-01-02 12:15) beholdes
+        self.assertEqual([("2030-01-02", 48), ("2030-01-03", 48)], c.fetchall())
+        c.execute("SELECT bucket, count FROM measurements_hourly WHERE device = ? AND bucket >= '2030-01-02 11:00:00' AND bucket < '2030-01-02 14:00:00'", (self.sensor,))
+        self.assertEqual([("2030-01-02 11:00:00", 2), ("2030-01-02 12:00:00", 2), ("2030-01-02 13:00:00", 2)], c.fetchall())
+        c.close()
+
+    def test_backfill_between_retention_chunks(self):
+        rows = [(self.sensor, f"2030-01-0{d} {h:02d}:00:00", 20.0, "°C") for d in range(1, 3) for h in range(24)]
+        self.repo.add_measurements(rows)
+        engine = RetentionEngine(self.repo, {"Temperature Sensor": RetentionPolicy(raw_days=1, hourly_days=None, daily_days=None)},
+                                 chunk_size=3)
+        # bakgrunnstrådens backfill kan slippe til mellom hver bit som slettes
+        with mock.patch.object(engine.stopped, "wait", side_effect=lambda timeout: self.repo.backfill_rollups("2030-01-01", "2030-01-02")):
+            engine.run_once(now=datetime(2030, 1, 3))
+        c = self.repo.cursor()
+        c.execute("SELECT bucket, count FROM measurements_daily WHERE device = ? AND bucket >= '2030-01-01'", (self.sensor,))
+        self.assertEqual([("2030-01-01", 24), ("2030-01-02", 24)], c.fetchall())
+        c.close()
 
 
 if __name__ == '__main__':